@@ -2,9 +2,34 @@
 # -*- coding: utf-8 -*-
 
 import os
+import errno
 import re
+import sys
+import json
+import ctypes
+import ctypes.util
+import select
+import struct
+import base64
+import binascii
+import atexit
 import shutil
+import stat
 import time
+import fnmatch
+import functools
+import itertools
+import threading
+import contextlib
+import collections
+import concurrent.futures
+try:
+    import fcntl  # reflink 用；Windows 上没有
+except ImportError:
+    fcntl = None
+import urllib.error
+import urllib.parse
+import urllib.request
 import gradio as gr
 
 # ====== 以下是 Selenium 及其依赖 ======
@@ -12,269 +37,2787 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 
 
 # ---------------------- (1) 批量磁力下载逻辑 ----------------------
-def start_download(magnet_input,server_addr):
+# 迅雷 Docker 的 Web 界面本身就是调用下面这些接口完成“新建任务”的：
+#   .create__task / .el-textarea__inner / .task-parse-btn  ->  drive/v1/resource/list
+#   .result-nas-task-dialog_footer 里的“下载”按钮          ->  drive/v1/task
+# 直接请求这些接口即可省掉整个无头浏览器。
+XUNLEI_API_PREFIX = "/webman/3rdparty/pan-xunlei-com/index.cgi"
+
+
+class XunleiApiError(Exception):
+    """迅雷接口返回错误、或无法连接时抛出。"""
+
+
+class XunleiAuthError(XunleiApiError):
+    """令牌无效或已过期（HTTP 401/403，或接口返回鉴权错误码），需要重新登录。"""
+
+
+XUNLEI_AUTH_HTTP_STATUS = (401, 403)
+XUNLEI_AUTH_ERROR_CODES = {"16"}  # 接口返回 unauthenticated 时的 error_code
+
+
+class XunleiHttpClient:
     """
-    从单个文本框中接收多条磁力链接（每行一条），
-    然后逐个在 Selenium 中执行下载。
+    迅雷 Docker Web 接口的极简客户端。
+    - login(): 从首页中取出 pan-auth 令牌，并查询设备 target(device_id)
+    - parse_magnet(): 解析磁力链接，返回资源信息
+    - create_task(): 按解析结果创建下载任务
+    多个后台线程共用同一个客户端；令牌失效时经 ensure_login 只由一个线程重新登录，其余线程沿用新令牌。
     """
-    # 按行拆分用户粘贴的磁力链接，并去掉空白行
-    magnet_links = [line.strip() for line in magnet_input.split("\n") if line.strip()]
-    # 初始化浏览器（若在树莓派Docker环境，可用 Chromium + chromedriver for ARM）
+
+    def __init__(self, server_addr: str, timeout: float = 10, parent_folder_id: str = ""):
+        self.base_url = server_addr.rstrip("/") + XUNLEI_API_PREFIX
+        self.timeout = timeout
+        self.parent_folder_id = parent_folder_id
+        self.token = None
+        self.device_id = None
+        self.generation = 0      # 每登录一次加 1，用来判断令牌是否已被别的线程换过
+        self._login_lock = threading.Lock()
+
+    def _request(self, method: str, path: str, payload=None, params=None):
+        url = self.base_url + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        data = None
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["pan-auth"] = self.token
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = resp.read().decode("utf-8", "ignore")
+        except urllib.error.HTTPError as e:
+            error = XunleiAuthError if e.code in XUNLEI_AUTH_HTTP_STATUS else XunleiApiError
+            raise error(f"HTTP {e.code}: {path}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise XunleiApiError(f"无法连接 {url}: {e}") from e
+        return body
+
+    def _request_json(self, method: str, path: str, payload=None, params=None) -> dict:
+        body = self._request(method, path, payload, params)
+        try:
+            result = json.loads(body) if body.strip() else {}
+        except ValueError as e:
+            raise XunleiApiError(f"接口返回的不是 JSON: {path}") from e
+        if isinstance(result, dict) and result.get("error"):
+            error = XunleiAuthError if str(result.get("error_code", "")) in XUNLEI_AUTH_ERROR_CODES else XunleiApiError
+            raise error(f"{result.get('error_code', '')} {result.get('error')}".strip())
+        return result
+
+    def login(self):
+        html = self._request("GET", "/")
+        match = re.search(r'uiauth\(\w*\)\s*\{\s*return\s*"([^"]+)"', html)
+        if not match:
+            raise XunleiApiError("未能在迅雷页面中找到 pan-auth 令牌")
+        self.token = match.group(1)
+
+        info = self._request_json("POST", "/device/info/watch", payload={})
+        self.device_id = info.get("target")
+        if not self.device_id:
+            self.token = None
+            raise XunleiApiError("未能获取迅雷设备 ID (target)")
+        self.generation += 1
+
+    def ensure_login(self, stale_generation: int = None):
+        """
+        还没有令牌时登录；传入 stale_generation（调用方发现令牌失效时看到的 generation）时，
+        只有令牌还没被别的线程换过才重新登录，否则直接沿用新令牌。登录过程加锁，同一时间只有一个线程在登录。
+        """
+        with self._login_lock:
+            if self.token and self.generation != stale_generation:
+                return
+            self.login()
+
+    def parse_magnet(self, link: str) -> dict:
+        result = self._request_json("POST", "/drive/v1/resource/list", payload={"urls": link})
+        resources = (result.get("list") or {}).get("resources") or []
+        if not resources:
+            raise XunleiApiError("磁力链接解析结果为空")
+        return resources[0]
+
+    def create_task(self, link: str, resource: dict) -> dict:
+        file_indices = _collect_file_indices(resource)
+        name = resource.get("name") or link
+        payload = {
+            "type": "user#download-url",
+            "name": name,
+            "file_name": name,
+            "file_size": str(resource.get("file_size", 0)),
+            "space": self.device_id,
+            "params": {
+                "target": self.device_id,
+                "url": link,
+                "total_file_count": str(resource.get("file_count") or len(file_indices) or 1),
+                "parent_folder_id": self.parent_folder_id,
+                "sub_file_index": ",".join(file_indices) or "0",
+                "file_id": "",
+            },
+        }
+        params = {"pan_auth": self.token, "device_space": ""}
+        return self._request_json("POST", "/drive/v1/task", payload=payload, params=params)
+
+    def submit(self, link: str) -> str:
+        self.ensure_login()
+        resource = self.parse_magnet(link)
+        self.create_task(link, resource)
+        return resource.get("name") or ""
+
+
+def _collect_file_indices(resource: dict) -> list:
+    """递归收集解析结果中所有文件的 file_index（对应弹窗里默认全选的文件）。"""
+    indices = []
+    children = (resource.get("dir") or {}).get("resources") or []
+    if not children and "file_index" in resource:
+        indices.append(str(resource["file_index"]))
+    for child in children:
+        indices.extend(_collect_file_indices(child))
+    return indices
+
+
+# 全局提交速率上限（条/秒，所有后台线程共享），避免把迅雷容器压垮；<= 0 表示不限速
+SUBMIT_RATE_LIMIT = 5.0
+
+
+class RateLimiter:
+    """令牌桶限速器：acquire(n) 在令牌不足时阻塞，直到允许再提交 n 条。"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: int = 1):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                # 一次要的比桶容量还多（批量弹窗）时，桶满即可放行，欠下的令牌由后面的请求慢慢还
+                if self._tokens >= min(n, self.capacity):
+                    self._tokens -= n
+                    return
+                delay = (min(n, self.capacity) - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+SUBMIT_RATE_LIMITER = RateLimiter(SUBMIT_RATE_LIMIT)
+
+
+# 按迅雷地址缓存已登录的客户端，后台队列逐条提交时不必每条都重新取令牌
+_HTTP_CLIENTS = {}
+_HTTP_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_http_client(server_addr: str) -> XunleiHttpClient:
+    with _HTTP_CLIENTS_LOCK:
+        client = _HTTP_CLIENTS.get(server_addr)
+        if client is None:
+            client = _HTTP_CLIENTS[server_addr] = XunleiHttpClient(server_addr)
+        return client
+
+
+def iter_submit_via_http(server_addr: str, magnet_links: list, batch_size: int = 1):
+    """
+    通过 HTTP 接口逐条提交磁力链接。每处理一条就 yield 一个结果字典：
+    {"link", "ok", "detail", "elapsed", "steps"}，steps 为各步骤耗时(秒)
+    batch_size 只是为了和其它后端保持同样的参数；HTTP 方式每条本来就只有两次请求。
+    """
+    client = _get_http_client(server_addr)
+    try:
+        client.ensure_login()
+    except XunleiApiError as e:
+        # 连首页都拿不到令牌时不必逐条重试，直接全部标记失败
+        for link in magnet_links:
+            yield {"link": link, "ok": False, "detail": str(e), "elapsed": 0.0}
+        return
+    for link in magnet_links:
+        start = time.monotonic()
+        steps = {}
+        try:
+            SUBMIT_RATE_LIMITER.acquire()
+            for retry in (False, True):
+                client.ensure_login()
+                generation = client.generation
+                try:
+                    resource = client.parse_magnet(link)
+                    steps["parse"] = time.monotonic() - start
+                    client.create_task(link, resource)
+                    steps["submit"] = time.monotonic() - start - steps["parse"]
+                    break
+                except XunleiAuthError:
+                    if retry:
+                        raise
+                    # 令牌过期：重新登录（别的线程已经换过令牌时直接沿用）后重试这一条；
+                    # 其它错误（如单条链接解析失败）不影响令牌，也不影响其它线程
+                    client.ensure_login(stale_generation=generation)
+            name = resource.get("name") or ""
+            yield {"link": link, "ok": True, "detail": name, "elapsed": time.monotonic() - start, "steps": steps}
+        except XunleiApiError as e:
+            yield {"link": link, "ok": False, "detail": str(e), "elapsed": time.monotonic() - start, "steps": steps}
+
+
+# 浏览器池配置：常驻的 Chrome 数量、单个 Chrome 处理多少条任务后重启、空闲多久后关闭(秒)
+# 池子会随界面上选择的并发数扩大（最多 MAX_SUBMIT_WORKERS 个）
+BROWSER_POOL_SIZE = 2
+BROWSER_MAX_TASKS = 50
+BROWSER_IDLE_TIMEOUT = 600
+
+
+class BrowserPool:
+    """
+    进程级的 Chrome 预热池，所有 Gradio 点击共享：
+    - borrow(url): 借出一个已启动、已打开 url 的 driver，用完自动归还
+    - 借出前做健康检查，挂掉的 driver 直接丢弃重建
+    - 空闲超过 idle_timeout 的 driver 由后台线程关闭
+    - 每个 driver 处理 max_tasks 次借用后回收重建，避免 Chrome 内存越涨越高
+    """
+
+    def __init__(self, factory, size: int = BROWSER_POOL_SIZE,
+                 max_tasks: int = BROWSER_MAX_TASKS, idle_timeout: float = BROWSER_IDLE_TIMEOUT):
+        self.factory = factory
+        self.size = size
+        self.max_tasks = max_tasks
+        self.idle_timeout = idle_timeout
+        self._idle = []          # 空闲的 {"driver", "tasks", "last_used", "url"}
+        self._total = 0          # 已创建且未关闭的 driver 数（含借出的）
+        self._cond = threading.Condition()
+        self._reaper = None
+
+    def _launch(self, url=None) -> dict:
+        driver = self.factory()
+        entry = {"driver": driver, "tasks": 0, "last_used": time.monotonic(), "url": None, "load_ms": None}
+        if url:
+            try:
+                driver.get(url)
+            except Exception:
+                self._quit(entry)
+                raise
+            entry["url"] = url
+            entry["load_ms"] = page_load_ms(driver)
+        return entry
+
+    @staticmethod
+    def _is_healthy(entry) -> bool:
+        try:
+            entry["driver"].execute_script("return document.readyState")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(entry):
+        try:
+            entry["driver"].quit()
+        except Exception:
+            pass
+
+    def _discard(self, entry):
+        self._quit(entry)
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def _acquire(self, url) -> dict:
+        while True:
+            with self._cond:
+                while not self._idle and self._total >= self.size:
+                    self._cond.wait()
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._total += 1
+                    entry = None
+
+            if entry is None:
+                try:
+                    return self._launch(url)
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+
+            expired = time.monotonic() - entry["last_used"] > self.idle_timeout
+            if expired or not self._is_healthy(entry):
+                self._discard(entry)
+                continue
+            if entry["url"] != url:
+                try:
+                    entry["driver"].get(url)
+                except Exception:
+                    # 例如页面加载超时：丢弃这个 driver，归还名额，否则池子会被占满、后续 borrow 永远等待
+                    self._discard(entry)
+                    raise
+                entry["url"] = url
+                entry["load_ms"] = page_load_ms(entry["driver"])
+            return entry
+
+    def _release(self, entry, broken: bool = False):
+        entry["tasks"] += 1
+        entry["last_used"] = time.monotonic()
+        if broken or entry["tasks"] >= self.max_tasks:
+            self._discard(entry)
+            return
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def borrow(self, url: str):
+        """借出一个已打开 url 的 driver；with 块内抛出异常时该 driver 视为损坏并丢弃。"""
+        self._start_reaper()
+        entry = self._acquire(url)
+        broken = False
+        try:
+            yield entry["driver"]
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._release(entry, broken)
+
+    def warm_up(self, url=None, count=None):
+        """提前启动 count 个（默认填满池子）driver，可选地预先打开 url。"""
+        self._start_reaper()
+        target = self.size if count is None else min(count, self.size)
+        while True:
+            with self._cond:
+                if self._total >= target:
+                    return
+                self._total += 1
+            try:
+                entry = self._launch(url)
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                raise
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def _reap_idle(self):
+        now = time.monotonic()
+        with self._cond:
+            expired = [e for e in self._idle if now - e["last_used"] > self.idle_timeout]
+            self._idle = [e for e in self._idle if e not in expired]
+        for entry in expired:
+            self._discard(entry)
+
+    def _start_reaper(self):
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reaper_loop, name="browser-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reaper_loop(self):
+        interval = max(1.0, min(60.0, self.idle_timeout / 2))
+        while True:
+            time.sleep(interval)
+            self._reap_idle()
+
+    def ensure_size(self, size: int):
+        """把池子扩大到至少 size 个 driver（只扩不缩，多出来的会因空闲超时自然关闭）。"""
+        with self._cond:
+            if size > self.size:
+                self.size = size
+                self._cond.notify_all()
+
+    def describe(self) -> str:
+        """池中各 Chrome 的处理次数、页面加载耗时与内存占用（借出中的不打扰，只计数）。"""
+        with self._cond:
+            idle = list(self._idle)
+            total = self._total
+        lines = [f"浏览器池：共 {total} 个 Chrome（上限 {self.size}），空闲 {len(idle)} 个，使用中 {total - len(idle)} 个"]
+        for i, entry in enumerate(idle, 1):
+            rss = chrome_rss_bytes(entry["driver"])
+            load = f"{entry['load_ms']} ms" if entry["load_ms"] is not None else "未知"
+            mem = f"{rss / 1024 / 1024:.0f} MB" if rss is not None else "未知"
+            lines.append(f"- 空闲 #{i}: 已借用 {entry['tasks']} 次，页面加载 {load}，内存(RSS) {mem}")
+        return "\n".join(lines)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._discard(entry)
+
+
+# chromedriver 路径；None 表示交给 Selenium 自动查找
+CHROMEDRIVER_PATH = "/usr/bin/chromedriver"
+# 提交流程用不到的资源：统计/广告脚本、图片、音视频、字体，通过 DevTools 在网络层直接拦截
+BLOCKED_URL_PATTERNS = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*hm.baidu.com*", "*cnzz.com*",
+    "*umeng.com*", "*growingio.com*", "*sentry*",
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.mp4", "*.webm", "*.mp3", "*.woff", "*.woff2", "*.ttf", "*.otf",
+]
+# 渲染进程 JS 堆上限(MB)，防止 Chrome 在树莓派上越用越大
+CHROME_JS_HEAP_MB = 256
+
+
+def create_chrome_driver():
+    """
+    创建一个为提交流程精简过的无头 Chrome（浏览器池的工厂函数，两个版本共用同一套参数）：
+    小窗口、关闭后台联网/同步/组件更新、限制渲染进程数与 JS 堆，并拦截统计脚本和大体积静态资源。
+    样式表不拦截：显式等待依赖元素的可见性，而可见性由 CSS 决定。
+    """
+    # 若在树莓派Docker环境，可用 Chromium + chromedriver for ARM
     chrome_options = Options()
     chrome_options.add_argument("--headless")  # 无头模式，可根据需要注释
-    chrome_options.add_argument("--no-sandbox")  # 关键
-    chrome_options.add_argument("--disable-dev-shm-usage")  # 关键
-    prefs = {"profile.managed_default_content_settings.images": 2,
-            "profile.managed_default_content_settings.stylesheets": 2,
-            "profile.managed_default_content_settings.fonts": 2}
-    service = Service("/usr/bin/chromedriver")
-    chrome_options.add_experimental_option("prefs", prefs)
+    chrome_options.add_argument("--no-sandbox")  # 容器内运行的关键参数
+    chrome_options.add_argument("--disable-dev-shm-usage")  # 同上
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--disable-extensions")
-    driver = webdriver.Chrome(options=chrome_options,service=service)
-    for link in magnet_links:
-        # 访问你的下载服务器页面
-        driver.get(server_addr)
-        driver.implicitly_wait(2)
+    chrome_options.add_argument("--window-size=1024,768")
+    chrome_options.add_argument("--disable-background-networking")
+    chrome_options.add_argument("--disable-component-update")
+    chrome_options.add_argument("--disable-default-apps")
+    chrome_options.add_argument("--disable-sync")
+    chrome_options.add_argument("--no-first-run")
+    chrome_options.add_argument("--mute-audio")
+    chrome_options.add_argument("--renderer-process-limit=1")
+    chrome_options.add_argument(f"--js-flags=--max-old-space-size={CHROME_JS_HEAP_MB}")
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    prefs = {"profile.managed_default_content_settings.images": 2}
+    chrome_options.add_experimental_option("prefs", prefs)
+    service = Service(CHROMEDRIVER_PATH) if CHROMEDRIVER_PATH else Service()
+    driver = webdriver.Chrome(options=chrome_options, service=service)
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception:
+        # 不支持 DevTools 协议的驱动，只依靠上面的启动参数精简
+        pass
+    return driver
+
+
+def page_load_ms(driver):
+    """当前页面从开始导航到 load 事件结束的耗时(毫秒)；取不到时返回 None。"""
+    try:
+        return driver.execute_script(
+            "const t = performance.timing;"
+            "return t.loadEventEnd > 0 ? t.loadEventEnd - t.navigationStart : null;"
+        )
+    except Exception:
+        return None
+
+
+def chrome_rss_bytes(driver):
+    """
+    chromedriver 及其启动的全部 Chrome 进程的常驻内存(RSS)之和。
+    通过 /proc 统计，仅 Linux 可用；其它系统返回 None。
+    """
+    pid = getattr(getattr(getattr(driver, "service", None), "process", None), "pid", None)
+    return process_tree_rss(pid) if pid else None
+
+
+def process_tree_rss(pid: int):
+    """pid 及其全部子孙进程的 RSS 之和(字节)；通过 /proc 统计，非 Linux 返回 None。"""
+    if not os.path.exists(f"/proc/{pid}"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+BROWSER_POOL = BrowserPool(create_chrome_driver)
+atexit.register(BROWSER_POOL.close_all)
+
+
+def warm_up_browser_pool(url=None, count=1):
+    """后台预热浏览器池；本机没有 Chrome 等情况只打印警告，不影响界面启动。"""
+    def _run():
+        try:
+            BROWSER_POOL.warm_up(url, count)
+        except Exception as e:
+            print(f"[WARN] 浏览器池预热失败（首次点击时会再尝试启动）: {e}")
+    threading.Thread(target=_run, name="browser-pool-warmup", daemon=True).start()
+
+
+# 迅雷“新建任务”弹窗中用到的元素
+SEL_CREATE_TASK = ".create__task"
+SEL_TASK_DIALOG = ".nas-task-dialog"
+SEL_TASK_INPUT = ".el-textarea__inner"
+SEL_PARSE_BTN = ".el-dialog__footer .el-button.el-button--primary.task-parse-btn"
+SEL_PARSE_SPINNER = ".nas-task-dialog .el-loading-mask"
+SEL_RESULT_FOOTER = ".result-nas-task-dialog_footer"
+SEL_DOWNLOAD_BTN = ".result-nas-task-dialog_footer .el-button.el-button--primary.task-parse-btn"
+# 批量解析时，结果弹窗中的每个任务条目，以及解析失败的提示（迅雷版本不同时按实际页面调整）
+SEL_RESULT_ITEM = ".result-nas-task-dialog .task-item"
+SEL_PARSE_ERROR = ".result-nas-task-dialog .task-item.is-error, .el-message--error"
+
+# 批量模式下每个弹窗一次提交的链接数；1 表示逐条提交
+SUBMIT_BATCH_SIZE = 10
+
+# 每一步等待页面条件成立的最长时间(秒)；条件满足后立即进入下一步，不再固定 sleep
+SELENIUM_STEP_TIMEOUT = 20
+
+# 结果中各步骤耗时的显示名称
+STEP_LABELS = {
+    "load": "加载页面",
+    "open": "打开弹窗",
+    "parse": "解析",
+    "submit": "提交",
+}
+
+
+def _ready_button(selector: str):
+    """条件：selector 对应的按钮可见、可点击，且不处于 loading 状态。"""
+    def _condition(driver):
+        for btn in driver.find_elements(By.CSS_SELECTOR, selector):
+            if btn.is_displayed() and btn.is_enabled() and "is-loading" not in (btn.get_attribute("class") or ""):
+                return btn
+        return False
+    return _condition
+
+
+def _ready_button_or_error(selector: str, error_selector: str):
+    """条件：按钮就绪时返回按钮；页面出现报错提示时返回 True。"""
+    ready = _ready_button(selector)
+
+    def _condition(driver):
+        if any(el.is_displayed() for el in driver.find_elements(By.CSS_SELECTOR, error_selector)):
+            return True
+        return ready(driver)
+    return _condition
+
+
+def _no_visible(selector: str):
+    """条件：页面上没有可见的 selector 元素（元素不存在也算）。"""
+    def _condition(driver):
+        return not any(el.is_displayed() for el in driver.find_elements(By.CSS_SELECTOR, selector))
+    return _condition
+
+
+class SubmitStepError(Exception):
+    """Selenium 提交过程中某一步失败；step 为失败的步骤名（见 STEP_LABELS）。"""
+
+    def __init__(self, step: str, message: str):
+        super().__init__(message)
+        self.step = step
+
+
+def _check_batch_parsed(driver, expected: int):
+    """解析后核对结果弹窗：不能有报错提示，且解析出的条目数不少于提交的链接数。"""
+    if any(el.is_displayed() for el in driver.find_elements(By.CSS_SELECTOR, SEL_PARSE_ERROR)):
+        raise ValueError("结果弹窗中有解析失败的链接")
+    items = [el for el in driver.find_elements(By.CSS_SELECTOR, SEL_RESULT_ITEM) if el.is_displayed()]
+    # 迅雷版本不同、条目选择器匹配不到时无法核对数量，只依赖上面的报错检查
+    if items and len(items) < expected:
+        raise ValueError(f"只解析出 {len(items)}/{expected} 条")
+
+
+def selenium_submit_links(driver, links: list, timeout: float = None) -> dict:
+    """
+    在已打开迅雷页面的 driver 中，通过同一个“新建任务”弹窗提交 links（每行一条），每一步都等待明确的页面条件：
+      open  : 点击“新建任务” -> 弹窗及输入框可见
+      parse : 点击解析按钮   -> 解析 loading 消失、结果弹窗的“下载”按钮可点击（多条时还会核对解析结果）
+      submit: 点击“下载”     -> 结果弹窗关闭
+    timeout 默认取 SELENIUM_STEP_TIMEOUT。
+    返回各步骤耗时 {"open": 秒, "parse": 秒, "submit": 秒}；任一步失败抛出 SubmitStepError。
+    """
+    timeout = timeout or SELENIUM_STEP_TIMEOUT
+    wait = WebDriverWait(driver, timeout, poll_frequency=0.1, ignored_exceptions=(StaleElementReferenceException,))
+    steps = {}
+
+    step = "open"
+    try:
+        start = time.monotonic()
+        wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, SEL_CREATE_TASK))).click()
+        wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, SEL_TASK_DIALOG)))
+        input_box = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, SEL_TASK_INPUT)))
+        if len(links) == 1:
+            input_box.send_keys(links[0])
+        else:
+            # 多行文本直接写入 value 并触发 input 事件（Vue 的 v-model 靠它同步），比逐字 send_keys 快得多
+            driver.execute_script(
+                "arguments[0].value = arguments[1];"
+                "arguments[0].dispatchEvent(new Event('input', {bubbles: true}));",
+                input_box, "\n".join(links)
+            )
+        steps[step] = time.monotonic() - start
+
+        step = "parse"
+        start = time.monotonic()
+        wait.until(_ready_button(SEL_PARSE_BTN)).click()
+        wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, SEL_RESULT_FOOTER)))
+        wait.until(_no_visible(SEL_PARSE_SPINNER))
+        # 解析失败时“下载”按钮不会变为可点击，看到报错就立即结束，不必等到超时
+        download_btn = wait.until(_ready_button_or_error(SEL_DOWNLOAD_BTN, SEL_PARSE_ERROR))
+        _check_batch_parsed(driver, len(links))
+        if download_btn is True:
+            raise ValueError("解析结果中有报错")
+        steps[step] = time.monotonic() - start
+
+        step = "submit"
+        start = time.monotonic()
+        download_btn.click()
+        wait.until(_no_visible(SEL_RESULT_FOOTER))
+        steps[step] = time.monotonic() - start
+    except TimeoutException as e:
+        raise SubmitStepError(step, f"{STEP_LABELS[step]}超时({timeout}s)") from e
+    except (WebDriverException, ValueError) as e:
+        message = getattr(e, "msg", None) or str(e)
+        raise SubmitStepError(step, f"{STEP_LABELS[step]}失败: {message}") from e
+    return steps
+
+
+def iter_submit_via_selenium(server_addr: str, magnet_links: list, batch_size: int = 1):
+    """
+    通过 Selenium 驱动迅雷网页提交磁力链接（原有方式，作为兜底）。
+    - batch_size > 1 时，每 batch_size 条通过同一个弹窗一次性解析、提交；
+      某一批解析失败时，这一批自动退回逐条提交。
+    结果格式与 iter_submit_via_http 相同。
+    """
+    if not magnet_links:
+        return
+    batch_size = max(1, int(batch_size))
+    done = 0
+    need_reload = False
+
+    def attempt(driver, links):
+        nonlocal need_reload
+        steps = {}
+        start = time.monotonic()
+        if need_reload:
+            # 上一次失败时页面状态不确定，重新加载；成功时弹窗已关闭，可直接继续
+            driver.get(server_addr)
+            steps["load"] = time.monotonic() - start
+        need_reload = True
+        SUBMIT_RATE_LIMITER.acquire(len(links))
+        steps.update(selenium_submit_links(driver, links))
+        need_reload = False
+        return steps
+
+    try:
+        # 从进程级浏览器池借一个已经打开页面的 driver，不再每次点击都冷启动 Chrome
+        with BROWSER_POOL.borrow(server_addr) as driver:
+            # 全部改用显式等待，关闭隐式等待以免两者叠加
+            driver.implicitly_wait(0)
+            for i in range(0, len(magnet_links), batch_size):
+                chunk = magnet_links[i:i + batch_size]
+                pending = chunk
+                if len(chunk) > 1:
+                    start = time.monotonic()
+                    try:
+                        steps = attempt(driver, chunk)
+                        elapsed = (time.monotonic() - start) / len(chunk)
+                        for link in chunk:
+                            done += 1
+                            yield {"link": link, "ok": True, "detail": f"批量提交 {len(chunk)} 条",
+                                   "elapsed": elapsed, "steps": steps}
+                        pending = []
+                    except SubmitStepError as e:
+                        if e.step == "submit":
+                            # 已经点了“下载”，任务可能已创建；退回逐条会重复提交，只如实报告
+                            for link in chunk:
+                                done += 1
+                                yield {"link": link, "ok": False, "elapsed": 0.0,
+                                       "detail": f"批量提交后未能确认（可能已提交，请在迅雷中核对）: {e}"}
+                            pending = []
+                        # 其它步骤失败时还没有创建任何任务，这一批退回逐条提交
+
+                for link in pending:
+                    start = time.monotonic()
+                    try:
+                        steps = attempt(driver, [link])
+                        result = {"link": link, "ok": True, "detail": "", "elapsed": time.monotonic() - start, "steps": steps}
+                    except Exception as e:
+                        result = {"link": link, "ok": False, "detail": str(e).strip(), "elapsed": time.monotonic() - start}
+                    done += 1
+                    yield result
+    except Exception as e:
+        # 浏览器无法启动/打开页面：剩余链接全部标记失败，不让整个批次抛异常
+        for link in magnet_links[done:]:
+            yield {"link": link, "ok": False, "detail": f"浏览器不可用: {e}", "elapsed": 0.0}
+
+
+# 可选的提交后端，键名即界面上的选项；"auto" = 先走 HTTP，失败的再交给 Selenium
+SUBMIT_BACKENDS = {
+    "http": iter_submit_via_http,
+    "selenium": iter_submit_via_selenium,
+}
+
+
+def submit_magnet_links(server_addr: str, magnet_links: list, backend: str = "auto",
+                        batch_size: int = SUBMIT_BATCH_SIZE) -> list:
+    """
+    按指定后端提交磁力链接，返回与 magnet_links 一一对应的结果列表。
+    batch_size 只对 Selenium 生效：每个“新建任务”弹窗一次提交的链接数。
+    """
+    if backend != "auto":
+        submit = SUBMIT_BACKENDS[backend]
+        return [dict(r, backend=backend) for r in submit(server_addr, magnet_links, batch_size)]
+
+    results = [dict(r, backend="http") for r in iter_submit_via_http(server_addr, magnet_links)]
+    retry_positions = [i for i, r in enumerate(results) if not r["ok"]]
+    if retry_positions:
+        retry_links = [magnet_links[i] for i in retry_positions]
+        for i, r in zip(retry_positions, iter_submit_via_selenium(server_addr, retry_links, batch_size)):
+            r["backend"] = "selenium"
+            r["detail"] = f"{r['detail']} (HTTP 失败原因: {results[i]['detail']})".strip()
+            results[i] = r
+    return results
+
+
+def format_submit_results(results: list) -> str:
+    ok_count = sum(1 for r in results if r["ok"])
+    skipped_count = sum(1 for r in results if r.get("state") == "skipped")
+    failed_count = len(results) - ok_count - skipped_count
+    summary = f"成功 {ok_count} 条，失败 {failed_count} 条"
+    if skipped_count:
+        summary += f"，跳过重复 {skipped_count} 条"
+    lines = [f"已处理 {len(results)} 条磁力链接！{summary}。"]
+    for r in results:
+        if r.get("state") == "skipped":
+            lines.append(f"[跳过] {r['link']} {r['detail']}")
+            continue
+        tag = "成功" if r["ok"] else "失败"
+        steps = " / ".join(f"{STEP_LABELS.get(k, k)} {v:.2f}s" for k, v in (r.get("steps") or {}).items())
+        line = f"[{tag}][{r['backend']}] {r['elapsed']:.2f}s {r['link']} {r['detail']}".rstrip()
+        lines.append(f"{line} ({steps})" if steps else line)
+    return "\n".join(lines)
+
+
+# 已成功提交过的磁力 infohash 记录（每行一个 40 位十六进制），用于跳过重复提交
+MAGNET_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "submitted_magnets.txt")
+
+BTIH_PATTERN = re.compile(r"xt=urn:btih:([0-9a-z]+)", re.IGNORECASE)
+
+
+def magnet_infohash(link: str):
+    """
+    从磁力链接的 xt=urn:btih: 中取出 infohash，统一转换为 20 字节的 bytes：
+    - 40 位十六进制（最常见）
+    - 32 位 base32（部分站点生成的格式）
+    无法识别时返回 None（这类链接不参与去重）。
+    """
+    match = BTIH_PATTERN.search(link)
+    if not match:
+        return None
+    value = match.group(1)
+    try:
+        if len(value) == 40:
+            return bytes.fromhex(value)
+        if len(value) == 32:
+            return base64.b32decode(value.upper())
+    except (ValueError, binascii.Error):
+        pass
+    return None
+
+
+class MagnetIndex:
+    """
+    已提交磁力的去重索引：只追加写入的文本文件 + 内存中的 set。
+    - 第一次使用时才读取文件；之后判断是否重复都是 O(1)
+    - 正在提交中的 infohash 单独记在 in_flight 中，同一批内、或多人同时粘贴的重复链接也会被跳过
+    - 只有提交成功的才写入文件；失败的释放掉，下次还能重试
+    """
+
+    def __init__(self, path: str = MAGNET_INDEX_PATH):
+        self.path = path
+        self._submitted = None
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._submitted is not None:
+            return
+        submitted = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="ascii", errors="ignore") as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 40:
+                        try:
+                            submitted.add(bytes.fromhex(line))
+                        except ValueError:
+                            continue
+        self._submitted = submitted
+
+    def reserve_many(self, infohashes: list) -> dict:
+        """
+        依次占用 infohashes（None 忽略）。返回 {下标: 跳过原因}，只包含重复的那些；
+        其余的被标记为“提交中”，之后必须调用 finish_many 释放或确认。
+        """
+        skipped = {}
+        with self._lock:
+            self._ensure_loaded()
+            for i, infohash in enumerate(infohashes):
+                if infohash is None:
+                    continue
+                if infohash in self._submitted:
+                    skipped[i] = "之前已提交过"
+                elif infohash in self._in_flight:
+                    skipped[i] = "重复链接，已在提交中"
+                else:
+                    self._in_flight.add(infohash)
+        return skipped
+
+    def finish_many(self, outcomes: list):
+        """outcomes 为 [(infohash, 是否成功)]：成功的追加写入文件，失败的释放。"""
+        new_lines = []
+        with self._lock:
+            self._ensure_loaded()
+            for infohash, ok in outcomes:
+                if infohash is None:
+                    continue
+                self._in_flight.discard(infohash)
+                if ok and infohash not in self._submitted:
+                    self._submitted.add(infohash)
+                    new_lines.append(infohash.hex() + "\n")
+            if new_lines:
+                with open(self.path, "a", encoding="ascii") as f:
+                    f.writelines(new_lines)
+
+
+MAGNET_INDEX = MagnetIndex()
+
+
+# 后台提交线程数（默认并发数）；各用户的批次按“轮转”方式交替取任务，互不阻塞
+DOWNLOAD_WORKERS = 2
+# 界面上允许选择的最大并发数：每个并发对应一个独立的 Chrome（或一路 HTTP 请求）
+MAX_SUBMIT_WORKERS = 8
+# Gradio 刷新进度的间隔(秒)
+PROGRESS_INTERVAL = 0.5
+
+# 单条链接在任务中的状态
+LINK_STATE_LABELS = {
+    "queued": "排队中",
+    "parsing": "解析中",
+    "submitted": "已提交",
+    "failed": "失败",
+    "skipped": "已跳过",
+}
+
+
+# 批次断点文件目录：每个批次一个 .jsonl，首行为批次信息，之后逐条追加链接的最终状态；
+# 程序崩溃或重启后，可以从未完成的链接继续，而不必整批重新粘贴
+DOWNLOAD_JOBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "download_jobs")
+# 已完成的批次文件保留天数
+DOWNLOAD_JOBS_KEEP_DAYS = 7
+
+
+class JobCheckpoint:
+    """单个批次的断点文件：只追加写入，每条链接完成时写一行，开销与链接数成正比。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, job, folder: str = DOWNLOAD_JOBS_DIR):
+        os.makedirs(folder, exist_ok=True)
+        checkpoint = cls(os.path.join(folder, f"job-{job.job_id}.jsonl"))
+        header = {
+            "job_id": job.job_id,
+            "server_addr": job.server_addr,
+            "backend": job.backend,
+            "batch_size": job.batch_size,
+            "concurrency": job.concurrency,
+            "created": time.time(),
+            "links": job.magnet_links,
+        }
+        with open(checkpoint.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        return checkpoint
+
+    def append(self, records: list):
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+    def finish(self):
+        self.append([{"done": True}])
+
+    def repair(self):
+        """崩溃时最后一行可能只写了一半，补上换行，避免之后追加的记录与它粘在一起。"""
+        with self._lock:
+            with open(self.path, "rb+") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+
+def load_job_checkpoint(path: str) -> dict:
+    """
+    读取断点文件，返回 {"header": 批次信息, "states": {下标: 最后一条状态记录}, "done": 是否已完成}。
+    最后一行可能因崩溃只写了一半，解析失败的行直接忽略。
+    """
+    header, states, done = None, {}, False
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if header is None:
+                header = record
+            elif record.get("done"):
+                done = True
+            elif "i" in record:
+                states[record["i"]] = record
+    if header is None:
+        raise ValueError(f"断点文件为空或已损坏: {path}")
+    return {"header": header, "states": states, "done": done}
+
+
+def list_unfinished_jobs(folder: str = DOWNLOAD_JOBS_DIR, include_failed: bool = False) -> list:
+    """
+    列出尚未完成的批次断点文件（按创建时间排序），顺便清理过期的已完成批次。
+    include_failed=True 时，已完成但仍有失败链接的批次也算在内（用于“重试失败”）。
+    """
+    if not os.path.isdir(folder):
+        return []
+    unfinished = []
+    expire_before = time.time() - DOWNLOAD_JOBS_KEEP_DAYS * 86400
+    for entry in os.scandir(folder):
+        if not entry.name.endswith(".jsonl"):
+            continue
+        try:
+            saved = load_job_checkpoint(entry.path)
+        except (OSError, ValueError):
+            continue
+        has_failed = any(r["state"] == "failed" for r in saved["states"].values())
+        if not saved["done"] or (include_failed and has_failed):
+            unfinished.append((saved["header"].get("created", 0), entry.path, saved))
+        elif entry.stat().st_mtime < expire_before:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    unfinished.sort(key=lambda item: item[0])
+    return [(path, saved) for _, path, saved in unfinished]
+
+
+class DownloadJob:
+    """一次“开始下载”点击（或一次断点恢复）对应的批次，保存每条链接的实时状态。"""
+
+    def __init__(self, job_id: str, owner: str, server_addr: str, magnet_links: list,
+                 backend: str, batch_size: int, infohashes: list = None, preset: dict = None,
+                 concurrency: int = DOWNLOAD_WORKERS):
+        self.job_id = job_id
+        self.owner = owner
+        self.server_addr = server_addr
+        self.magnet_links = magnet_links
+        self.backend = backend
+        self.batch_size = max(1, int(batch_size))
+        # HTTP 每条都很快，逐条调度进度最细；需要 Selenium 时按弹窗批量大小调度
+        self.chunk_size = 1 if backend == "http" else self.batch_size
+        # 本批次最多同时有几段在提交（由队列在锁内维护 active）
+        self.concurrency = max(1, min(int(concurrency), MAX_SUBMIT_WORKERS))
+        self.active = 0
+        self.infohashes = infohashes or [None] * len(magnet_links)
+        self.checkpoint = None
+        # preset: {下标: 结果字段}，不需要再提交的链接（重复跳过、上次运行已完成）
+        preset = preset or {}
+        self.results = [
+            {"link": link, "state": "queued", "ok": False, "detail": "", "elapsed": 0.0, "backend": backend}
+            for link in magnet_links
+        ]
+        for i, fields in preset.items():
+            self.results[i].update(fields)
+        self.created = time.monotonic()
+        self.done = threading.Event()
+        self._todo = [i for i in range(len(magnet_links)) if i not in preset]
+        self._next_pos = 0
+        self._pending = len(self._todo)
+        self._lock = threading.Lock()
+        if not self._todo:
+            self.done.set()
+
+    def take_chunk(self) -> list:
+        """取出下一段尚未分派的链接下标（由队列在锁内调用）。"""
+        start = self._next_pos
+        self._next_pos = min(start + self.chunk_size, len(self._todo))
+        return self._todo[start:self._next_pos]
+
+    def fully_dispatched(self) -> bool:
+        return self._next_pos >= len(self._todo)
+
+    def mark_started(self, indices: list):
+        now = time.monotonic()
+        with self._lock:
+            for i in indices:
+                self.results[i].update(state="parsing", started=now)
+
+    def mark_finished(self, indices: list, results: list):
+        records = []
+        with self._lock:
+            for i, r in zip(indices, results):
+                self.results[i].update(r, state="submitted" if r["ok"] else "failed")
+                records.append({"i": i, "state": self.results[i]["state"],
+                                "backend": self.results[i].get("backend", ""), "detail": r.get("detail", "")})
+            self._pending -= len(indices)
+            finished = self._pending <= 0
+        if self.checkpoint:
+            self.checkpoint.append(records)
+            if finished:
+                self.checkpoint.finish()
+        if finished:
+            self.done.set()
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [dict(r) for r in self.results]
+
+
+class DownloadJobQueue:
+    """
+    进程内的磁力提交队列：
+    - submit() 立即返回 DownloadJob，实际提交由后台线程完成
+    - 不同用户（Gradio 会话）的任务按轮转方式交替调度，大批次不会独占后台线程
+    - 每个批次写断点文件，resume() 可在重启后从未完成的链接继续
+    """
+
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, jobs_dir: str = DOWNLOAD_JOBS_DIR):
+        self.workers = workers
+        self.jobs_dir = jobs_dir
+        self._owners = collections.OrderedDict()  # owner -> deque[DownloadJob]
+        self._cond = threading.Condition()
+        self._threads = []
+        self._job_ids = itertools.count(1)
+        self._live = {}  # job_id -> 本进程中尚未完成的 DownloadJob
+
+    def _new_job_id(self) -> str:
+        # 带上时间，重启后编号不会与旧的断点文件冲突
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._job_ids)}"
+
+    def submit(self, owner: str, server_addr: str, magnet_links: list,
+               backend: str = "auto", batch_size: int = SUBMIT_BATCH_SIZE, dedup: bool = True,
+               concurrency: int = DOWNLOAD_WORKERS) -> DownloadJob:
+        # 在任何浏览器/网络操作之前按 infohash 去重
+        infohashes = [magnet_infohash(link) for link in magnet_links]
+        skipped = MAGNET_INDEX.reserve_many(infohashes) if dedup else {}
+        preset = {i: {"state": "skipped", "detail": reason} for i, reason in skipped.items()}
+        job = DownloadJob(self._new_job_id(), owner, server_addr, magnet_links, backend, batch_size,
+                          infohashes, preset, concurrency)
+        return self._enqueue(job, [{"i": i, **fields} for i, fields in preset.items()])
+
+    def resume(self, path: str, owner: str, retry_failed: bool = True, dedup: bool = True) -> DownloadJob:
+        """
+        从断点文件恢复批次：已提交/已跳过的链接保持原状态，其余的重新排队；
+        retry_failed=True 时上次失败的链接也一并重试。
+        """
+        saved = load_job_checkpoint(path)
+        header = saved["header"]
+        with self._cond:
+            live = self._live.get(header["job_id"])
+        if live:
+            # 该批次仍在本进程中运行，直接返回它，避免重复提交
+            return live
+        magnet_links = header["links"]
+        preset = {}
+        for i, record in saved["states"].items():
+            if record["state"] == "failed" and retry_failed:
+                continue
+            preset[i] = {
+                "state": record["state"],
+                "ok": record["state"] == "submitted",
+                "backend": record.get("backend", ""),
+                "detail": f"(上次运行) {record.get('detail', '')}".rstrip(),
+            }
+        infohashes = [magnet_infohash(link) for link in magnet_links]
+        skipped = {}
+        if dedup:
+            pending_hashes = [None if i in preset else h for i, h in enumerate(infohashes)]
+            skipped = MAGNET_INDEX.reserve_many(pending_hashes)
+        new_records = []
+        for i, reason in skipped.items():
+            preset[i] = {"state": "skipped", "detail": reason}
+            new_records.append({"i": i, **preset[i]})
+        job = DownloadJob(header["job_id"], owner, header["server_addr"], magnet_links, header["backend"],
+                          header["batch_size"], infohashes, preset, header.get("concurrency", DOWNLOAD_WORKERS))
+        job.checkpoint = JobCheckpoint(path)
+        job.checkpoint.repair()
+        return self._enqueue(job, new_records)
+
+    def _enqueue(self, job: DownloadJob, initial_records: list) -> DownloadJob:
+        if not job.magnet_links:
+            return job
+        if job.checkpoint is None:
+            job.checkpoint = JobCheckpoint.create(job, self.jobs_dir)
+        if initial_records:
+            job.checkpoint.append(initial_records)
+        if job.done.is_set():
+            job.checkpoint.finish()
+            return job
+        if job.backend != "http":
+            BROWSER_POOL.ensure_size(job.concurrency)
+        with self._cond:
+            self._live[job.job_id] = job
+            self._owners.setdefault(job.owner, collections.deque()).append(job)
+            self.workers = max(self.workers, job.concurrency)
+            self._start_workers()
+            self._cond.notify_all()
+        return job
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker_loop, name=f"download-worker-{len(self._threads) + 1}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _pick_locked(self):
+        """按轮转顺序找到第一个还没达到并发上限的批次；都满了返回 None。"""
+        for owner, jobs in self._owners.items():
+            job = jobs[0]
+            if job.active >= job.concurrency:
+                continue
+            indices = job.take_chunk()
+            job.active += 1
+            if job.fully_dispatched():
+                jobs.popleft()
+            if jobs:
+                # 该用户还有剩余，排到队尾，让其他用户先取
+                self._owners.move_to_end(owner)
+            else:
+                del self._owners[owner]
+            return job, indices
+        return None
+
+    def _next_chunk(self):
+        with self._cond:
+            while True:
+                picked = self._pick_locked()
+                if picked:
+                    return picked
+                self._cond.wait()
+
+    def _chunk_done(self, job: DownloadJob):
+        with self._cond:
+            job.active -= 1
+            if job.done.is_set():
+                self._live.pop(job.job_id, None)
+            self._cond.notify_all()
+
+    def _worker_loop(self):
+        while True:
+            job, indices = self._next_chunk()
+            job.mark_started(indices)
+            links = [job.magnet_links[i] for i in indices]
+            try:
+                results = submit_magnet_links(job.server_addr, links, job.backend, job.batch_size)
+            except Exception as e:
+                results = [{"link": link, "ok": False, "detail": str(e), "elapsed": 0.0} for link in links]
+            MAGNET_INDEX.finish_many([(job.infohashes[i], r["ok"]) for i, r in zip(indices, results)])
+            job.mark_finished(indices, results)
+            self._chunk_done(job)
+
+
+DOWNLOAD_JOB_QUEUE = DownloadJobQueue()
+
+
+def format_job_progress(job: DownloadJob) -> str:
+    results = job.snapshot()
+    counts = collections.Counter(r["state"] for r in results)
+    summary = "，".join(f"{label} {counts.get(state, 0)}" for state, label in LINK_STATE_LABELS.items())
+    lines = [f"批次 #{job.job_id}：共 {len(results)} 条，{summary}，已用时 {time.monotonic() - job.created:.1f}s"]
+    now = time.monotonic()
+    for r in results:
+        label = LINK_STATE_LABELS[r["state"]]
+        if r["state"] == "parsing":
+            lines.append(f"[{label}] {now - r['started']:.1f}s {r['link']}")
+        elif r["state"] in ("queued", "skipped"):
+            lines.append(f"[{label}] {r['link']} {r['detail']}".rstrip())
+        else:
+            lines.append(f"[{label}][{r['backend']}] {r['elapsed']:.2f}s {r['link']} {r['detail']}".rstrip())
+    return "\n".join(lines)
+
+
+def stream_download_job(job: DownloadJob):
+    """供 Gradio 使用的生成器：定期输出批次进度，全部完成后输出最终汇总。"""
+    while not job.done.wait(PROGRESS_INTERVAL):
+        yield format_job_progress(job)
+    yield format_submit_results(job.snapshot())
+
+
+def resume_unfinished_downloads(retry_failed: bool = True, owner: str = "default"):
+    """
+    生成器：把断点目录中未完成（以及 retry_failed 时含失败链接）的批次重新排队，
+    并持续输出各批次进度。读不了的断点文件只记一条错误（放在每次输出的最前面），其余批次照常恢复。
+    """
+    queue = DOWNLOAD_JOB_QUEUE
+    jobs, errors = [], []
+    for path, _ in list_unfinished_jobs(queue.jobs_dir, include_failed=retry_failed):
+        try:
+            jobs.append(queue.resume(path, owner, retry_failed))
+        except (OSError, ValueError, KeyError) as e:
+            errors.append(f"[ERROR] 无法恢复批次 {os.path.basename(path)}: {e}")
+    if not jobs:
+        yield "\n".join(errors) or "没有需要恢复的批次。"
+        return
+    sections = ["\n".join(errors)] if errors else []
+    while not all(job.done.wait(PROGRESS_INTERVAL / len(jobs)) for job in jobs):
+        yield "\n\n".join(sections + [format_job_progress(job) for job in jobs])
+    yield "\n\n".join(sections + [f"批次 #{job.job_id}\n" + format_submit_results(job.snapshot()) for job in jobs])
+
+
+
+def start_download(magnet_input, server_addr, backend="auto", batch_size=SUBMIT_BATCH_SIZE, dedup=True,
+                   concurrency=DOWNLOAD_WORKERS, request: gr.Request = None):
+    """
+    从单个文本框中接收多条磁力链接（每行一条），放入后台提交队列，
+    并以生成器的方式持续输出每条链接的状态（排队中/解析中/已提交/失败）。
+    """
+    # 按行拆分用户粘贴的磁力链接，并去掉空白行
+    magnet_links = [line.strip() for line in magnet_input.split("\n") if line.strip()]
+    owner = getattr(request, "session_hash", None) or "default"
+    job = DOWNLOAD_JOB_QUEUE.submit(
+        owner, server_addr, magnet_links, backend, int(batch_size), dedup, int(concurrency)
+    )
+    yield from stream_download_job(job)
+
+
+# ---------------------- (2) 文件处理工具逻辑 ----------------------
+# 目录遍历统一走 os.scandir：一次读目录即可拿到每个条目的类型
+def scan_dir(folder_path: str):
+    """
+    读取 folder_path 的直接子项，返回 (子文件夹列表, 文件列表)，元素均为 os.DirEntry。
+    条目类型直接取自读目录时返回的信息，不再对每个条目单独 stat（在 SMB 上每次 stat 都是一次网络往返）。
+    目录本身无法读取时抛出 OSError。
+    """
+    dirs, files = [], []
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    dirs.append(entry)
+                elif entry.is_file():
+                    files.append(entry)
+            except OSError:
+                continue
+    return dirs, files
+
+
+def is_empty_dir(folder_path: str) -> bool:
+    """读到第一个条目就返回，不必列出整个目录。"""
+    with os.scandir(folder_path) as it:
+        return next(it, None) is None
+
+
+# 遍历时默认跳过的文件夹：隐藏目录（迅雷缓存、.incomplete 等）、*.incomplete、群晖 / Windows 的系统目录
+WALK_EXCLUDE_DEFAULT = ".*, *.incomplete, @eaDir, #recycle, $RECYCLE.BIN, System Volume Information"
+
+
+def compile_exclude_globs(patterns: str):
+    """
+    把逗号或换行分隔的通配符（如 ".*, *.incomplete"）合并成一个不区分大小写的正则，
+    返回判断文件夹名是否应跳过的函数；没有填写时返回 None。
+    """
+    globs = [pattern.strip() for pattern in re.split(r"[,\n]", patterns or "") if pattern.strip()]
+    if not globs:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in globs), re.IGNORECASE).match
+
+
+def iter_matching_dirs(root_folder: str, match, recursive: bool = False, max_depth: int = 0, exclude: str = "",
+                       prune: bool = False, include_root: bool = False, notes: list = None):
+    """
+    按需遍历 root_folder，产出名称命中的文件夹 (路径, match(名称) 的返回值, 文件 DirEntry 列表)，父文件夹先于子文件夹。
+    - match(name) 返回 None 表示不命中；include_root=True 时根目录本身也参与匹配；
+    - 非递归时只看第一层子文件夹；递归时 max_depth > 0 限制最多进入几层（不跟随符号链接目录）；
+    - 递归时，名称匹配 exclude 通配符的文件夹连同整个子树跳过（非递归时不生效，第一层照旧全部参与匹配）；
+    - prune=True 时命中的文件夹处理完就不再进入其子文件夹；
+    - 既不命中、也不需要再往下走的文件夹不会被列目录。
+    无法读取的目录记入 notes。
+    """
+    skip = compile_exclude_globs(exclude) if recursive else None
+    limit = int(max_depth or 0) if recursive else 1
+    root_result = match(os.path.basename(os.path.normpath(root_folder))) if include_root else None
+    stack = [(root_folder, 0, root_result)]
+    while stack:
+        folder, depth, result = stack.pop()
+        descend = (not limit or depth < limit) and not (prune and result is not None)
+        if result is None and not descend:
+            continue
+        try:
+            dirs, files = scan_dir(folder)
+        except OSError as e:
+            if notes is not None:
+                notes.append(f"[ERROR] 无法访问目录: {folder}, 错误原因: {e}")
+            continue
+        if result is not None:
+            yield folder, result, files
+        if descend:
+            children = [
+                (d.path, depth + 1, match(d.name)) for d in dirs
+                if not (recursive and d.is_symlink()) and not (skip and skip(d.name))
+            ]
+            stack.extend(reversed(children))
+
+
+# 并行移动：按 (源设备, 目标设备) 分组的有界线程池
+MOVE_WORKERS = 4                   # 同时进行的文件移动数上限
+MOVE_WORKERS_PER_DEVICE = 2        # 同一对 (源设备, 目标设备) 上同时进行的移动数，避免同一块盘来回寻道
+MOVE_COPY_BUFFER = 8 * 1024 * 1024  # 跨设备复制退回普通读写时的缓冲区大小
+MOVE_COPY_CHUNK = 64 * 1024 * 1024  # copy_file_range / sendfile 每次调用复制的字节数（也是进度刷新的粒度）
+MOVE_RESUME_PROBE = 1024 * 1024     # 续传前比对临时文件末尾的字节数
+MOVE_PARTIAL_SUFFIX = ".moving"     # 跨设备复制时目标旁边的临时文件后缀
+MOVE_PROGRESS_INTERVAL = 1.0       # 界面刷新移动进度的间隔(秒)
+# move：把文件移走；link：在目标处建硬链接 / reflink（不行时复制），源文件留在下载目录供迅雷继续做种
+MOVE_ACTIONS = {"move": "移动", "link": "归档"}
+FICLONE = 0x40049409               # linux/fs.h 中的 FICLONE ioctl，让两个文件共享数据块（btrfs / xfs 等）
+
+
+def format_bytes(num: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num) < 1024:
+            return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+
+class MoveProgress:
+    """
+    记录一次批量移动的进度（线程安全），供界面定期刷新：
+    已完成/失败的文件数、已传输字节数，以及由此算出的 bytes/s、files/s。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total_files = 0
+        self.total_bytes = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.bytes_done = 0
+        self.started = time.monotonic()
+
+    def start(self, total_files: int, total_bytes: int):
+        with self._lock:
+            self.total_files = total_files
+            self.total_bytes = total_bytes
+            self.started = time.monotonic()
+
+    def add_bytes(self, count: int):
+        with self._lock:
+            self.bytes_done += count
+
+    def file_done(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.files_done += 1
+            else:
+                self.files_failed += 1
+
+    def _rates(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return elapsed, self.bytes_done / elapsed, (self.files_done + self.files_failed) / elapsed
+
+    def describe(self) -> str:
+        with self._lock:
+            elapsed, bytes_rate, files_rate = self._rates()
+            return (f"[进度] 文件 {self.files_done + self.files_failed}/{self.total_files}（失败 {self.files_failed}），"
+                    f"已传输 {format_bytes(self.bytes_done)} / {format_bytes(self.total_bytes)}，"
+                    f"{format_bytes(bytes_rate)}/s，{files_rate:.2f} 个/s，已用时 {elapsed:.1f}s")
+
+    def summary(self) -> str:
+        with self._lock:
+            elapsed, bytes_rate, files_rate = self._rates()
+            return (f"[汇总] 共 {self.total_files} 个文件：成功 {self.files_done}，失败 {self.files_failed}，"
+                    f"传输 {format_bytes(self.bytes_done)}，用时 {elapsed:.1f}s，"
+                    f"平均 {format_bytes(bytes_rate)}/s，{files_rate:.2f} 个/s")
+
+
+def _copy_range(fsrc, fdst, offset: int, total: int, on_bytes=None) -> int:
+    """
+    把 fsrc 从 offset 起到 total 为止的内容写到 fdst 的相同位置，返回最终偏移。
+    依次尝试 os.copy_file_range（数据不经过用户态，部分文件系统可直接在服务端/块层完成）、
+    os.sendfile，最后退回大块 readinto/write（Windows 走这条路）。
+    """
+    for name in ("copy_file_range", "sendfile"):
+        copier = getattr(os, name, None)
+        if copier is None:
+            continue
+        try:
+            os.lseek(fdst.fileno(), offset, os.SEEK_SET)
+            while offset < total:
+                count = min(total - offset, MOVE_COPY_CHUNK)
+                if name == "copy_file_range":
+                    copied = copier(fsrc.fileno(), fdst.fileno(), count, offset, offset)
+                else:
+                    copied = copier(fdst.fileno(), fsrc.fileno(), offset, count)
+                if not copied:
+                    break
+                offset += copied
+                if on_bytes is not None:
+                    on_bytes(copied)
+            return offset
+        except OSError as e:
+            # 跨文件系统 / 文件系统不支持时换下一种方式；已经复制的部分保留，从当前 offset 继续
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+
+    buffer = bytearray(MOVE_COPY_BUFFER)
+    view = memoryview(buffer)
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    while offset < total:
+        read = fsrc.readinto(buffer)
+        if not read:
+            break
+        fdst.write(view[:read])
+        offset += read
+        if on_bytes is not None:
+            on_bytes(read)
+    return offset
+
+
+def _resumable_offset(src: str, partial: str, src_size: int) -> int:
+    """
+    检查上次中断留下的临时文件能否续传：大小不超过源文件，且末尾一段与源文件对应位置一致。
+    能续传时返回已复制的字节数，否则返回 0（从头复制）。
+    """
+    try:
+        partial_size = os.path.getsize(partial)
+    except OSError:
+        return 0
+    if not 0 < partial_size <= src_size:
+        return 0
+    probe = min(partial_size, MOVE_RESUME_PROBE)
+    try:
+        with open(src, "rb") as fsrc, open(partial, "rb") as fpart:
+            fsrc.seek(partial_size - probe)
+            fpart.seek(partial_size - probe)
+            if fsrc.read(probe) != fpart.read(probe):
+                return 0
+    except OSError:
+        return 0
+    return partial_size
+
+
+def move_one_file(src: str, dst: str, size: int = 0, on_bytes=None) -> str:
+    """
+    移动单个文件，返回所用方式的简短说明（同设备改名时为空字符串）。
+    - 源文件与目标文件夹在同一设备上：直接改名（rename_no_replace），只改目录项；
+    - 否则复制到目标旁的临时文件 (dst + MOVE_PARTIAL_SUFFIX)，校验大小、落盘后
+      不覆盖地换到目标位置，最后删除源文件；
+    - 上次中断留下的临时文件会被校验并从断点续传，而不是留下半截文件。
+    目标已存在时报错，不覆盖（被覆盖的文件撤销时也找不回来）。
+    """
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "目标已存在", dst)
+    src_stat = os.stat(src)
+    try:
+        same_device = src_stat.st_dev == os.stat(os.path.dirname(dst) or ".").st_dev
+    except OSError:
+        same_device = False
+    if same_device:
+        try:
+            rename_no_replace(src, dst)
+            if on_bytes is not None:
+                on_bytes(size or src_stat.st_size)
+            return ""
+        except FileExistsError:
+            raise
+        except OSError:
+            # 例如同一服务器的不同 SMB 共享，退回复制
+            pass
+
+    offset = _copy_into_place(src, dst, src_stat.st_size, on_bytes)
+    os.unlink(src)
+    return f"续传，自 {format_bytes(offset)} 起" if offset else "跨设备复制"
+
+
+def _copy_into_place(src: str, dst: str, total: int, on_bytes=None) -> int:
+    """
+    复制到目标旁的临时文件 (dst + MOVE_PARTIAL_SUFFIX)，校验大小、落盘后原子地换到目标位置（不覆盖已有文件）。
+    上次中断留下的临时文件会被校验并从断点续传。返回续传的起点（0 表示从头复制）。
+    """
+    partial = dst + MOVE_PARTIAL_SUFFIX
+    offset = _resumable_offset(src, partial, total)
+    with open(src, "rb") as fsrc, open(partial, "r+b" if offset else "wb") as fdst:
+        if offset:
+            fdst.truncate(offset)
+        copied_to = _copy_range(fsrc, fdst, offset, total, on_bytes)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+        written = os.fstat(fdst.fileno()).st_size
+    if copied_to != total or written != total:
+        raise OSError(f"复制后大小不一致：源文件 {total} 字节，临时文件 {written} 字节（已保留 {partial}，可再次执行续传）")
+    shutil.copystat(src, partial)
+    try:
+        rename_no_replace(partial, dst)
+    except FileExistsError:
+        # 复制期间目标被占用：源文件还在，临时文件删掉即可
+        with contextlib.suppress(OSError):
+            os.unlink(partial)
+        raise
+    return offset
+
+
+def _reflink(src: str, dst: str) -> bool:
+    """尝试让新建的 dst 与 src 共享数据块；不支持（或非 Linux）时返回 False，且不留下目标文件。"""
+    if fcntl is None:
+        return False
+    try:
+        fdst = open(dst, "xb")
+    except OSError:
+        return False
+    try:
+        with fdst, open(src, "rb") as fsrc:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.unlink(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def link_one_file(src: str, dst: str, size: int = 0, on_bytes=None) -> str:
+    """
+    把 src 归档到 dst，源文件原样保留（迅雷可以继续做种）。返回实际使用的方式：
+    - 同一设备：优先硬链接，只增加一个目录项；文件系统不支持硬链接时尝试 reflink；
+    - 都不行（跨设备、共享不支持链接等）时退回复制，过程与 move_one_file 相同（临时文件 + 断点续传）。
+    目标已存在时报错，不覆盖。
+    """
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "目标已存在", dst)
+    src_stat = os.stat(src)
+    try:
+        same_device = src_stat.st_dev == os.stat(os.path.dirname(dst) or ".").st_dev
+    except OSError:
+        same_device = False
+    if same_device:
+        try:
+            os.link(src, dst)
+            strategy = "硬链接"
+        except FileExistsError:
+            raise
+        except OSError:
+            strategy = "reflink" if _reflink(src, dst) else ""
+        if strategy:
+            if on_bytes is not None:
+                on_bytes(size or src_stat.st_size)
+            return strategy
+    offset = _copy_into_place(src, dst, src_stat.st_size, on_bytes)
+    return f"复制，续传自 {format_bytes(offset)} 起" if offset else "复制"
+
+
+def _device_key(path: str, cache: dict):
+    """返回 path 所在设备的标识；stat 失败时退回盘符 / UNC 共享名。"""
+    if path not in cache:
+        try:
+            cache[path] = os.stat(path).st_dev
+        except OSError:
+            cache[path] = os.path.splitdrive(os.path.abspath(path))[0].lower()
+    return cache[path]
+
+
+def execute_moves(moves: list, workers: int = MOVE_WORKERS, per_device: int = MOVE_WORKERS_PER_DEVICE,
+                  progress: MoveProgress = None, stamps: list = None, action: str = "move") -> list:
+    """
+    并行执行 [(源路径, 目标路径), ...]；action 为 "link" 时用 link_one_file 归档而不是移动。
+    - 按 (源设备, 目标设备) 分组，每组最多 per_device 个线程同时搬运，总线程数不超过 workers；
+    - stamps 为与 moves 对应的 [大小, mtime_ns]（来自 FileOpPlan），与当前不一致的文件不移动；
+    - 返回与 moves 一一对应的结果 {"src", "dst", "ok", "error", "detail"}（detail 为 move_one_file / link_one_file 的返回值）。
+    """
+    progress = progress or MoveProgress()
+    file_op = link_one_file if action == "link" else move_one_file
+    results = [None] * len(moves)
+    groups = collections.OrderedDict()
+    # 同一批次里多个文件移动到同一目标路径时，只执行第一个，其余判为失败，避免并行写同一个文件
+    seen_dst = {}
+    for index, (src, dst) in enumerate(moves):
+        key = os.path.normcase(os.path.abspath(dst))
+        if key in seen_dst:
+            results[index] = {"src": src, "dst": dst, "ok": False, "detail": "",
+                              "error": f"目标路径与 {moves[seen_dst[key]][0]} 重名，已跳过"}
+        else:
+            seen_dst[key] = index
+    dev_cache = {}
+    total_bytes = 0
+    for index, (src, dst) in enumerate(moves):
+        if results[index] is not None:
+            continue
+        try:
+            st = os.stat(src)
+        except OSError as e:
+            results[index] = {"src": src, "dst": dst, "ok": False, "error": str(e), "detail": ""}
+            continue
+        reason = FileOpPlan.changed({"src": src, "stamp": stamps[index]}, st) if stamps else ""
+        if reason:
+            results[index] = {"src": src, "dst": dst, "ok": False, "error": reason, "detail": ""}
+            continue
+        key = (st.st_dev, _device_key(os.path.dirname(dst) or ".", dev_cache))
+        groups.setdefault(key, collections.deque()).append((index, src, dst, st.st_size))
+        total_bytes += st.st_size
+    progress.start(len(moves), total_bytes)
+    for r in results:
+        if r is not None:
+            progress.file_done(False)
+
+    def drain(queue):
+        while True:
+            try:
+                index, src, dst, size = queue.popleft()
+            except IndexError:
+                return
+            try:
+                detail = file_op(src, dst, size, progress.add_bytes)
+                results[index] = {"src": src, "dst": dst, "ok": True, "error": "", "detail": detail}
+            except Exception as e:
+                results[index] = {"src": src, "dst": dst, "ok": False, "error": str(e), "detail": ""}
+            progress.file_done(results[index]["ok"])
+
+    # 按轮次交错提交各组的搬运线程，保证每个设备组在第一轮就能分到线程
+    drains = []
+    for round_index in range(max(1, per_device)):
+        for queue in groups.values():
+            if round_index < len(queue):
+                drains.append(queue)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for queue in drains:
+            pool.submit(drain, queue)
+    return results
+
+
+def format_move_detail(result: dict) -> str:
+    return f"（{result['detail']}）" if result.get("detail") else ""
+
+
+def run_with_progress(task, progress: MoveProgress, interval: float = MOVE_PROGRESS_INTERVAL):
+    """供 Gradio 使用的生成器：后台执行 task()，期间定期输出进度，结束后输出 task 的返回值。"""
+    outcome = {}
+
+    def _run():
+        try:
+            outcome["text"] = task()
+        except Exception as e:
+            outcome["text"] = f"[ERROR] 执行出错: {e}"
+
+    worker = threading.Thread(target=_run, daemon=True)
+    worker.start()
+    while True:
+        worker.join(interval)
+        if not worker.is_alive():
+            break
+        if progress.total_files:
+            yield progress.describe()
+    yield outcome["text"]
+
+
+# 操作计划：预览时扫描一次，执行时直接复用
+class FileOpPlan:
+    """
+    一次扫描得到的文件操作计划，可序列化为 dict / JSON（保存在界面状态里，或写到文件）。
+    - kind / params: 生成计划时的操作类型与参数，执行时参数一致才会复用；
+    - items: [{"src", "dst", "stamp"}]，stamp 为扫描时源文件的 [大小, mtime_ns]；
+    - notes: 扫描时产生的日志（跳过、无法访问的目录等），执行时原样带上。
+    执行时只对计划里的文件各做一次 stat，与 stamp 不一致的跳过，不再重新遍历目录树。
+    """
+
+    def __init__(self, kind: str, params: dict, items: list = None, notes: list = None, created: float = None):
+        self.kind = kind
+        self.params = dict(params)
+        self.items = items if items is not None else []
+        self.notes = notes if notes is not None else []
+        self.created = created if created is not None else time.time()
+
+    def add(self, src: str, dst: str = None, entry=None):
+        """加入一项操作；传入 os.DirEntry 时记录其大小与 mtime（Windows 上直接取自目录读取结果）。"""
+        stamp = None
+        if entry is not None:
+            try:
+                st = entry.stat()
+                stamp = [st.st_size, st.st_mtime_ns]
+            except OSError:
+                pass
+        self.items.append({"src": src, "dst": dst, "stamp": stamp})
+
+    def matches(self, kind: str, params: dict) -> bool:
+        return self.kind == kind and self.params == params
+
+    @staticmethod
+    def changed(item: dict, st=None) -> str:
+        """源文件自扫描后是否变化：未变化返回空字符串，否则返回原因。st 为已取得的 os.stat 结果。"""
+        if item.get("stamp") is None:
+            return ""
+        if st is None:
+            try:
+                st = os.stat(item["src"])
+            except OSError as e:
+                return f"源文件已不存在: {e}"
+        if [st.st_size, st.st_mtime_ns] != list(item["stamp"]):
+            return "自预览后文件已变化"
+        return ""
+
+    def describe(self) -> str:
+        return (f"[INFO] 按 {time.strftime('%H:%M:%S', time.localtime(self.created))} 预览得到的计划执行"
+                f"（{len(self.items)} 项），不再重新扫描目录")
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "params": self.params, "items": self.items,
+                "notes": self.notes, "created": self.created}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["kind"], data["params"], data.get("items"), data.get("notes"), data.get("created"))
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, text: str):
+        return cls.from_dict(json.loads(text))
+
+
+def reuse_or_build_plan(plan, kind: str, params: dict, build, logs: list, preview: bool = False):
+    """plan 与本次参数一致时直接复用，否则调用 build() 重新扫描。"""
+    if plan is not None and plan.matches(kind, params):
+        if not preview:
+            logs.append(plan.describe())
+        return plan
+    if plan is not None:
+        logs.append("[INFO] 参数与预览时不同，已重新扫描")
+    return build()
+
+
+def plan_from_state(state):
+    """界面状态 (gr.State) 中保存的是 FileOpPlan.to_dict() 的结果，没有时返回 None。"""
+    return FileOpPlan.from_dict(state) if state else None
+
+
+# 操作日志：每次实际执行的移动 / 重命名 / 删除空文件夹各写一个只追加的 .jsonl，“撤销上一次操作”据此倒序回放
+OPERATION_JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "operation_journal")
+OPERATION_JOURNAL_KEEP = 20     # 最多保留最近多少次操作的日志（含已撤销的）
+OPERATION_JOURNAL_BATCH = 256   # 攒够多少条记录写入并 fsync 一次；操作结束时剩下的一起写入
+OPERATION_UNDONE_SUFFIX = ".undone"
+
+
+class OperationJournal:
+    """
+    一次操作的日志文件：首行为操作信息，之后每行一个已完成的动作
+    ["mv", 原路径, 新路径] / ["ln", 源文件, 归档文件] / ["mkdir", 路径] / ["rmdir", 路径]。
+    记录先攒在内存里，每 OPERATION_JOURNAL_BATCH 条写入并 fsync 一次（5000 个文件只需二十来次 fsync），
+    程序崩溃时最多丢失最后一批记录。record 可在多个线程中同时调用；用 with 包住整个操作，结束时自动写完。
+    """
+
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self.count = 0
+        self._pending = [json.dumps(header, ensure_ascii=False)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def begin(cls, kind: str, summary: str, folder: str = OPERATION_JOURNAL_DIR):
+        """新建一次操作的日志（文件名以纳秒时间开头，按名称排序即按时间排序）。"""
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"op-{time.time_ns()}-{kind}.jsonl")
+        return cls(path, {"kind": kind, "summary": summary, "created": time.time()})
+
+    def record(self, action: str, *paths):
+        line = json.dumps([action, *paths], ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._pending.append(line)
+            self.count += 1
+            if len(self._pending) >= OPERATION_JOURNAL_BATCH:
+                self._flush()
+
+    def _flush(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._pending) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = []
+
+    def close(self):
+        """写入剩下的记录；一个动作都没做成的操作不留日志。"""
+        with self._lock:
+            if self.count and self._pending:
+                self._flush()
+        if self.count:
+            prune_operation_journals(os.path.dirname(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def list_operation_journals(folder: str = OPERATION_JOURNAL_DIR, include_undone: bool = False) -> list:
+    """按时间从旧到新列出操作日志文件。"""
+    if not os.path.isdir(folder):
+        return []
+    names = sorted(
+        name for name in os.listdir(folder)
+        if name.startswith("op-") and (name.endswith(".jsonl") or (include_undone and name.endswith(OPERATION_UNDONE_SUFFIX)))
+    )
+    return [os.path.join(folder, name) for name in names]
+
+
+def prune_operation_journals(folder: str = OPERATION_JOURNAL_DIR, keep: int = OPERATION_JOURNAL_KEEP):
+    journals = list_operation_journals(folder, include_undone=True)
+    for path in journals[:max(0, len(journals) - keep)]:
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+
+
+def load_operation_journal(path: str):
+    """返回 (操作信息, 动作列表)；崩溃时只写了一半的最后一行直接忽略。"""
+    header, actions = None, []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if header is None:
+                header = record
+            elif isinstance(record, list) and record:
+                actions.append(record)
+    if header is None:
+        raise ValueError(f"操作日志为空或已损坏: {path}")
+    return header, actions
+
+
+def rewrite_operation_journal(path: str, header: dict, actions: list):
+    """把日志原子地改写为 header + actions（先写临时文件再替换，中途崩溃也不会丢掉原日志）。"""
+    temp = path + ".tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        f.writelines(json.dumps(action, ensure_ascii=False, separators=(",", ":")) + "\n" for action in actions)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def make_dirs(folder: str, journal: OperationJournal = None):
+    """
+    os.makedirs，并把这次新建的每一层文件夹（从外到内）记入 journal，撤销时由内到外逐个删除，
+    不会只删掉最里面一层、留下一串空的上级文件夹。
+    """
+    missing, path = [], os.path.abspath(folder)
+    while not os.path.exists(path):
+        missing.append(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    try:
+        os.makedirs(folder)
+    finally:
+        if journal is not None:
+            for path in reversed(missing):
+                if os.path.isdir(path):
+                    journal.record("mkdir", path)
+
+
+def undo_action(action: list):
+    """撤销单个动作；不覆盖任何已有文件，撤销不了时抛出异常。"""
+    kind, paths = action[0], action[1:]
+    if kind == "mv":
+        src, dst = paths
+        os.makedirs(os.path.dirname(src) or ".", exist_ok=True)
+        try:
+            rename_no_replace(dst, src)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # 当初是跨设备移动的，原样复制回去
+            if os.path.lexists(src):
+                raise FileExistsError(errno.EEXIST, "原位置已有同名文件", src)
+            move_one_file(dst, src)
+    elif kind == "ln":
+        src, dst = paths
+        if not os.path.exists(src):
+            raise FileNotFoundError(errno.ENOENT, "源文件已不在，保留归档文件", src)
+        os.unlink(dst)
+    elif kind == "mkdir":
+        os.rmdir(paths[0])
+    elif kind == "rmdir":
+        os.makedirs(paths[0], exist_ok=True)
+    else:
+        raise ValueError(f"未知的动作: {kind}")
+
+
+def describe_action(action: list) -> str:
+    kind, paths = action[0], action[1:]
+    if kind in ("mv", "ln"):
+        return f"{paths[1]} -> {paths[0]}" if kind == "mv" else f"删除归档文件 {paths[1]}"
+    return f"{'删除' if kind == 'mkdir' else '重建'}文件夹 {paths[0]}"
+
+
+def undo_operation(path: str) -> str:
+    """
+    按日志倒序撤销一次操作：只读这一个日志文件，不扫描任何目录。
+    单步失败（例如文件之后又被改动过）记入日志并继续。全部成功后日志标记为已撤销，不会被撤销第二次；
+    有失败时日志只保留失败的步骤，处理好原因后再点一次撤销即可重试，而不会跳去撤销更早的操作。
+    """
+    header, actions = load_operation_journal(path)
+    created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(header.get("created", 0)))
+    logs = [f"[撤销] {header.get('summary', '')}（{created}，共 {len(actions)} 步）"]
+    failed = []
+    for action in reversed(actions):
+        try:
+            undo_action(action)
+            logs.append(f"[撤销成功] {describe_action(action)}")
+        except Exception as e:
+            failed.append(action)
+            logs.append(f"[撤销失败] {describe_action(action)}, 原因: {e}")
+    if failed:
+        rewrite_operation_journal(path, header, failed[::-1])
+    else:
+        os.replace(path, path + OPERATION_UNDONE_SUFFIX)
+    logs.append(f"[汇总] 撤销 {len(actions) - len(failed)} 步，失败 {len(failed)} 步")
+    if failed:
+        logs.append("[INFO] 失败的步骤已留在操作日志中，处理后再次点击撤销即可重试")
+    return "\n".join(logs)
+
+
+def undo_last_operation(folder: str = OPERATION_JOURNAL_DIR) -> str:
+    """撤销最近一次尚未撤销的操作；再点一次撤销再往前的一次。"""
+    journals = list_operation_journals(folder)
+    if not journals:
+        return "[INFO] 没有可以撤销的操作"
+    try:
+        return undo_operation(journals[-1])
+    except (OSError, ValueError) as e:
+        return f"[ERROR] 读取操作日志失败: {journals[-1]}, 原因: {e}"
+
+
+def plan_move_files(
+    root_folder: str,
+    keyword: str,
+    target_folder: str,
+    recursive: bool = False,
+    max_depth: int = 0,
+    exclude: str = "",
+    prune: bool = False
+) -> FileOpPlan:
+    """
+    扫描 root_folder，找出名称含 keyword 的子文件夹(或子孙文件夹)下的所有文件，
+    生成“移动到 target_folder”的操作计划。max_depth / exclude / prune 见 iter_matching_dirs。
+    """
+    plan = FileOpPlan("move", {
+        "root_folder": root_folder,
+        "keyword": keyword,
+        "target_folder": target_folder,
+        "recursive": bool(recursive),
+        "max_depth": int(max_depth or 0),
+        "exclude": exclude or "",
+        "prune": bool(prune),
+    })
+
+    # 递归时根目录本身也参与匹配（与按 os.walk 遍历时一致）
+    for _, _, files in iter_matching_dirs(root_folder, lambda name: (keyword in name) or None, recursive,
+                                          max_depth, exclude, prune, include_root=recursive, notes=plan.notes):
+        for file in files:
+            plan.add(file.path, os.path.join(target_folder, file.name), file)
+    return plan
+
+
+# 权限：移动后的文件要放开到 777，宿主机 / SMB 上的其他用户才能继续处理
+PERMISSION_MODE = 0o777
+
+
+def fix_permissions(paths, mode: int = PERMISSION_MODE):
+    """
+    一次遍历 paths（去重，每个路径只处理一次），只对权限不是 mode 的路径调用 chmod。
+    返回 (修改的路径数, 错误信息列表)。
+    """
+    changed, errors = 0, []
+    for path in dict.fromkeys(paths):
+        try:
+            if stat.S_IMODE(os.stat(path).st_mode) != mode:
+                os.chmod(path, mode)
+                changed += 1
+        except OSError as e:
+            errors.append(f"{path}: {e}")
+    return changed, errors
+
+
+def format_strategy_summary(details: list) -> str:
+    """归档模式下统计每种方式（硬链接 / reflink / 复制）各用了多少个文件。"""
+    counts = collections.Counter(detail.split("，")[0] for detail in details if detail)
+    return "[汇总] 归档方式：" + "，".join(f"{name} {count} 个" for name, count in counts.most_common())
+
+
+def run_planned_moves(items: list, logs: list, workers: int = MOVE_WORKERS, progress: MoveProgress = None,
+                      action: str = "move", journal: OperationJournal = None):
+    """
+    并行执行计划中的移动，日志追加到 logs。
+    action 为 "link" 时改为归档：硬链接 / reflink / 复制到目标，源文件保留，并记录每个文件用的方式。
+    全部完成后，把新文件及其所在的目标文件夹一次性改为 777（已经是 777 的不动）。
+    传入 journal 时，每个成功的文件记一条（mv / ln），供撤销使用。
+    """
+    if not items:
+        return
+    progress = progress or MoveProgress()
+    label = MOVE_ACTIONS[action]
+    details = []
+    moves = [(item["src"], item["dst"]) for item in items]
+    stamps = [item["stamp"] for item in items]
+    touched = {}
+    for r in execute_moves(moves, workers=workers, progress=progress, stamps=stamps, action=action):
+        if not r["ok"]:
+            logs.append(f"[{label}失败] {r['src']} -> {r['dst']}, 原因: {r['error']}")
+            continue
+        if journal is not None:
+            journal.record("ln" if action == "link" else "mv", r["src"], r["dst"])
+        details.append(r["detail"])
+        touched.setdefault(r["dst"])
+        touched.setdefault(os.path.dirname(r["dst"]))
+        logs.append(f"[{label}成功] {r['src']} -> {r['dst']}{format_move_detail(r)}")
+    if touched:
+        changed, errors = fix_permissions(touched)
+        logs.append(f"[权限] 检查 {len(touched)} 个路径，其中 {changed} 个改为 {PERMISSION_MODE:o}")
+        logs.extend(f"[ERROR] 修改权限失败: {error}" for error in errors)
+    logs.append(progress.summary())
+    if action == "link" and details:
+        logs.append(format_strategy_summary(details))
+
+
+def move_files_with_keyword_in_subfolder(
+    root_folder: str,
+    keyword: str,
+    target_folder: str,
+    create_if_not_exists: bool = True,
+    recursive: bool = False,
+    preview: bool = True,
+    workers: int = MOVE_WORKERS,
+    progress: MoveProgress = None,
+    max_depth: int = 0,
+    exclude: str = "",
+    prune: bool = False,
+    action: str = "move",
+    plan: FileOpPlan = None
+) -> str:
+    """
+    在 root_folder 下查找所有子文件夹(或子孙文件夹)：
+      - 若文件夹名称包含 keyword，则将其下所有文件移动到 target_folder。
+      - 如果 preview=True，则仅打印操作，不执行移动。
+      - 传入预览时得到的 plan（且参数一致）时直接按计划执行，不再重新扫描。
+      - 实际移动时按设备分组并行执行（workers 为同时移动的文件数），最后附上吞吐汇总。
+      - action="link" 时不移动而是归档：硬链接 / reflink / 复制到目标，源文件保留继续做种。
+      - 实际执行的每一步都写入操作日志（OperationJournal），可以一键撤销。
+    """
+    logs = []
+    plan = reuse_or_build_plan(
+        plan, "move",
+        {"root_folder": root_folder, "keyword": keyword, "target_folder": target_folder, "recursive": bool(recursive),
+         "max_depth": int(max_depth or 0), "exclude": exclude or "", "prune": bool(prune)},
+        lambda: plan_move_files(root_folder, keyword, target_folder, recursive, max_depth, exclude, prune),
+        logs, preview
+    )
+    logs.extend(plan.notes)
+
+    if preview:
+        for item in plan.items:
+            logs.append(f"[预览] 将{MOVE_ACTIONS[action]}: {item['src']} -> {item['dst']}")
+        return "\n".join(logs)
+
+    with OperationJournal.begin("move", f"{MOVE_ACTIONS[action]} {root_folder} 中含“{keyword}”的文件 -> {target_folder}") as journal:
+        if create_if_not_exists and not os.path.exists(target_folder):
+            try:
+                make_dirs(target_folder, journal)
+                logs.append(f"[INFO] 已创建目标文件夹: {target_folder}")
+            except Exception as e:
+                logs.append(f"[ERROR] 无法创建目标文件夹: {target_folder}, 错误原因: {e}")
+                return "\n".join(logs)
+
+        run_planned_moves(plan.items, logs, workers, progress, action=action, journal=journal)
+    return "\n".join(logs)
+
+
+DEFAULT_PATTERN_CONFIG = [
+    {
+        "name": "提取 EP 后面的数字",
+        "pattern": r"EP(\d+)",
+        "rename_func": lambda m: m.group(1),
+    },
+    {
+        "name": "提取第一个数字串",
+        "pattern": r"(\d+)",
+        "rename_func": lambda m: m.group(1),
+    },
+]
+
+# =============================================================================
+# 剧集文件名解析（自定义正则填 @episode 时作为第一条规则使用）
+# =============================================================================
+EPISODE_RULE_TOKEN = "@episode"  # 自定义正则填这个（不区分大小写）时，先用内置的剧集解析器，解析不出再走默认规则
+EPISODE_CACHE_SIZE = 8192        # 解析结果按文件名缓存，重复预览同一个下载目录时不再重新解析
+
+EpisodeInfo = collections.namedtuple("EpisodeInfo", "season episode episode_end year resolution")
+
+_CN_NUMBER = r"[0-9０-９零〇一二两三四五六七八九十百千]+"
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+# 按优先级排列：S02E03(-E05)、2x03、第N季/第N集(-M集)、EP03(-05)/Episode 3、Season 2
+EPISODE_SXXEYY = re.compile(r"(?<![a-z0-9])s(\d{1,2})[ ._-]?e(\d{1,4})(?:[ ._]?(?:-[ ._]?e?|e)(\d{1,4}))?(?!\d)", re.I)
+EPISODE_NXM = re.compile(r"(?<![a-z0-9])(\d{1,2})x(\d{2,3})(?![a-z0-9])", re.I)
+EPISODE_CN_SEASON = re.compile(rf"第\s*({_CN_NUMBER})\s*季")
+EPISODE_CN = re.compile(rf"第\s*({_CN_NUMBER})\s*(?:[-~～至到]\s*(?:第\s*)?({_CN_NUMBER})\s*)?[集话話回期]")
+EPISODE_WORD = re.compile(r"(?<![a-z])(?:episode|ep|e)[ ._-]?(\d{1,4})(?:[ ._]?[-~][ ._]?(?:ep|e)?(\d{1,4}))?(?!\d)", re.I)
+EPISODE_SEASON_WORD = re.compile(r"(?<![a-z])(?:season[ ._-]?|s)(\d{1,2})(?![0-9])", re.I)
+# 分辨率、年份和编码/音轨等标记不会被当成集数
+EPISODE_RESOLUTION = re.compile(r"(?<![a-z0-9])(\d{3,4}[pi]|[248]k)(?![a-z0-9])", re.I)
+EPISODE_YEAR = re.compile(r"(?<![0-9])((?:19|20)\d{2})(?![0-9])")
+EPISODE_NOISE = re.compile(
+    r"(?<![a-z0-9])(?:\d{3,4}[pi]|[248]k|\d{3,4}x\d{3,4}|[xh]\.?26[45]|(?:1[02]|8)[ -]?bits?"
+    r"|(?:ddp?|aac|ac3|eac3|dts|truehd|flac|atmos)?\d\.\d|\[[0-9a-f]{8}\])(?![a-z0-9])", re.I)
+EPISODE_NUMBER = re.compile(r"(?<![a-z0-9.])(\d{1,4})(?:[-~](\d{1,4}))?(?:v\d)?(?![0-9])", re.I)
+
+
+def parse_cn_number(text: str) -> int:
+    """把 "12"、"１２"、"十二"、"一百零五" 这类写法换成整数。"""
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+        elif ch in _CN_UNITS:
+            total += (digit or 1) * _CN_UNITS[ch]
+            digit = 0
+    return total + digit
+
+
+@functools.lru_cache(maxsize=EPISODE_CACHE_SIZE)
+def parse_episode(filename: str):
+    """
+    从影视文件名中解析季、集（支持 S02E03、S02E03-E05、2x03、EP03、第12集、第1-3集、第二季 等写法），
+    分辨率和年份单独识别，不会被误当成集数。解析不出集数时返回 None。
+    结果按文件名缓存（EPISODE_CACHE_SIZE）。
+    """
+    stem = os.path.splitext(filename)[0]
+    resolution = EPISODE_RESOLUTION.search(stem)
+    resolution = resolution.group(1).lower() if resolution else None
+    year = EPISODE_YEAR.search(EPISODE_NOISE.sub(" ", stem))
+    year = int(year.group(1)) if year else None
+
+    season = episode = episode_end = None
+    m = EPISODE_SXXEYY.search(stem) or EPISODE_NXM.search(stem)
+    if m:
+        season, episode = int(m.group(1)), int(m.group(2))
+        if m.lastindex >= 3 and m.group(3):
+            episode_end = int(m.group(3))
+    else:
+        m = EPISODE_CN_SEASON.search(stem)
+        if m:
+            season = parse_cn_number(m.group(1))
+        m = EPISODE_CN.search(stem) or EPISODE_WORD.search(stem)
+        if m:
+            episode = parse_cn_number(m.group(1))
+            if m.group(2):
+                episode_end = parse_cn_number(m.group(2))
+        if season is None:
+            m = EPISODE_SEASON_WORD.search(stem)
+            if m:
+                season = int(m.group(1))
+        if episode is None:
+            # 没有明确标记时，去掉分辨率/年份/编码等标记后取最后一个数字（或 01-03 这样的范围）
+            rest = EPISODE_YEAR.sub(" ", EPISODE_NOISE.sub(" ", stem))
+            if season is not None:
+                rest = EPISODE_SEASON_WORD.sub(" ", rest)
+            numbers = EPISODE_NUMBER.findall(rest)
+            if numbers:
+                first, last = numbers[-1]
+                episode = int(first)
+                episode_end = int(last) if last else None
+
+    if episode is None:
+        return None
+    if episode_end is not None and episode_end <= episode:
+        episode_end = None
+    return EpisodeInfo(season, episode, episode_end, year, resolution)
+
+
+def format_episode(info: EpisodeInfo) -> str:
+    """解析结果作为匹配结果接在前缀后面时的写法：03，范围为 03-05。"""
+    if info.episode_end is not None:
+        return f"{info.episode:02d}-{info.episode_end:02d}"
+    return f"{info.episode:02d}"
+
+
+def episode_fields(info: EpisodeInfo) -> dict:
+    """前缀模板可用的字段；没有季信息时 {season} 按第 1 季处理。"""
+    return {
+        "season": info.season if info.season is not None else 1,
+        "episode": info.episode,
+        "episode_end": info.episode_end if info.episode_end is not None else info.episode,
+        "year": info.year if info.year is not None else "",
+        "resolution": info.resolution or "",
+    }
+
+
+EPISODE_RULE = {
+    "name": "剧集文件名解析",
+    "parse": parse_episode,
+    "rename_func": format_episode,
+}
+
+# 前缀里可以写 {season:02}、{episode:02} 这样的字段（冒号后为 Python 格式说明）；写了字段时按模板生成文件名
+RENAME_TEMPLATE_FIELD = re.compile(r"\{(season|episode|episode_end|year|resolution)(?::([^{}]*))?\}")
+
+
+def render_target_name(prefix: str, suffix: str, fields: dict, ext: str) -> str:
+    """前缀不含模板字段时为 前缀 + 匹配结果 + 扩展名；含字段时按模板填好后加扩展名（匹配结果不再追加）。"""
+    if not RENAME_TEMPLATE_FIELD.search(prefix):
+        return f"{prefix}{suffix}{ext}"
+
+    def fill(m):
+        value = fields.get(m.group(1), "")
+        try:
+            return format(value, m.group(2) or "")
+        except (TypeError, ValueError):
+            return str(value)
+
+    return RENAME_TEMPLATE_FIELD.sub(fill, prefix) + ext
+
+
+RENAME_RULES_CACHE_SIZE = 32  # 缓存最近用过的规则集（自定义正则 + 默认规则）的编译结果
+
+# 含反向引用的正则合并后分组编号会变，这类规则集退回逐条匹配
+RENAME_UNCOMBINABLE = re.compile(r"\\\d|\(\?P=")
+
+
+class _RuleMatch:
+    """把合并正则的匹配结果换算回单条规则自己的分组编号，rename_func 照旧写 m.group(1)。"""
+
+    __slots__ = ("_match", "_offset", "_groups")
+
+    def __init__(self, match, offset: int, groups: int):
+        self._match = match
+        self._offset = offset
+        self._groups = groups
+
+    def _index(self, index):
+        if isinstance(index, str):
+            return index  # 命名分组保持原名
+        if not 0 <= index <= self._groups:
+            raise IndexError("no such group")
+        return self._offset + index
+
+    def group(self, *indexes):
+        values = [self._match.group(self._index(index)) for index in (indexes or (0,))]
+        return values[0] if len(values) == 1 else tuple(values)
+
+    __getitem__ = group
+
+    def groups(self, default=None):
+        return tuple(
+            default if value is None else value
+            for value in (self._match.group(self._offset + i) for i in range(1, self._groups + 1))
+        )
+
+
+class RenameRules:
+    """
+    一组重命名规则预编译成的匹配器（由 build_pattern_config 生成并缓存）。
+    所有规则合并成一个正则  (?=任意前缀(?P<_rule0>规则0))|(?=任意前缀(?P<_rule1>规则1))|...，
+    从文件名开头匹配一次即可：结果与按顺序逐条 re.search 相同（前面的规则优先，同一规则取最靠左的匹配）。
+    有无法合并的规则（反向引用、写在中间的 (?i) 等）时，退回逐条匹配预编译好的正则。
+    """
+
+    def __init__(self, rules: list):
+        # 带 parse 的是解析器规则（如 EPISODE_RULE），先于所有正则规则尝试
+        self.parsers = [rule for rule in rules if "parse" in rule]
+        self.rules = [rule for rule in rules if "parse" not in rule]
+        self._compiled = [re.compile(rule["pattern"]) for rule in self.rules]
+        self._combined = None
+        self._offsets = {}
+        if any(RENAME_UNCOMBINABLE.search(rule["pattern"]) for rule in self.rules):
+            return
+        try:
+            combined = re.compile("|".join(
+                f"(?=[\\s\\S]*?(?P<_rule{i}>{rule['pattern']}))" for i, rule in enumerate(self.rules)
+            ))
+        except re.error:
+            return
+        self._combined = combined
+        # 整条规则外面那层分组最后闭合，所以 lastgroup 就是命中的规则
+        self._offsets = {
+            f"_rule{i}": (i, combined.groupindex[f"_rule{i}"], pattern.groups)
+            for i, pattern in enumerate(self._compiled)
+        }
+
+    def match(self, name: str):
+        """返回 (命中的规则, 匹配结果)；全部不匹配时返回 None。"""
+        if self._combined is None:
+            for rule, pattern in zip(self.rules, self._compiled):
+                found = pattern.search(name)
+                if found:
+                    return rule, found
+            return None
+        found = self._combined.match(name)
+        if not found:
+            return None
+        index, offset, groups = self._offsets[found.lastgroup]
+        return self.rules[index], _RuleMatch(found, offset, groups)
+
+    def target_name(self, old_name: str, prefix: str):
+        """
+        返回新文件名（前缀 + 匹配结果 + 原扩展名，前缀含 {season} 等字段时按模板生成）；
+        不匹配或结果为空时返回 None。正则规则只提供 {episode}（即匹配结果），{season} 按第 1 季处理。
+        """
+        ext = os.path.splitext(old_name)[1]
+        for rule in self.parsers:
+            info = rule["parse"](old_name)
+            if info is not None:
+                return render_target_name(prefix, rule["rename_func"](info), episode_fields(info), ext)
+        found = self.match(old_name)
+        if not found:
+            return None
+        rule, match_obj = found
+        new_suffix = rule["rename_func"](match_obj)
+        if new_suffix:
+            fields = {"season": 1, "episode": int(new_suffix) if new_suffix.isdigit() else new_suffix}
+            return render_target_name(prefix, new_suffix, fields, ext)
+        return None
+
+
+@functools.lru_cache(maxsize=RENAME_RULES_CACHE_SIZE)
+def _compile_rename_rules(custom_pattern: str, default_rules: tuple):
+    """按规则集编译并缓存，返回 (RenameRules, 自定义正则的错误信息或 None)。"""
+    rules, error = [], None
+    if custom_pattern.lower() == EPISODE_RULE_TOKEN:
+        rules.append(EPISODE_RULE)
+    elif custom_pattern:
+        try:
+            re.compile(custom_pattern)
+            rules.append({
+                "name": "自定义规则",
+                "pattern": custom_pattern,
+                "rename_func": lambda m: m.group(1),
+            })
+        except re.error as e:
+            error = e
+    rules.extend({"name": name, "pattern": pattern, "rename_func": func} for name, pattern, func in default_rules)
+    return RenameRules(rules), error
+
+
+def build_pattern_config(custom_pattern: str = "", notes: list = None) -> RenameRules:
+    """
+    自定义正则(若有效)放在最前面，其后是默认规则，编译成 RenameRules（同一规则集只编译一次）；
+    自定义正则填 @episode 时，最前面换成内置的剧集文件名解析器（EPISODE_RULE）；
+    自定义正则无效时把原因写入 notes。
+    """
+    default_rules = tuple((rule["name"], rule["pattern"], rule["rename_func"]) for rule in DEFAULT_PATTERN_CONFIG)
+    pattern_config, error = _compile_rename_rules(custom_pattern.strip(), default_rules)
+    if error is not None and notes is not None:
+        notes.append(f"自定义正则无效: {custom_pattern}, 错误原因: {error}")
+    return pattern_config
 
-        # 点击“新建任务”
-        new_task_btn = driver.find_element(By.CSS_SELECTOR, ".create__task")
-        new_task_btn.click()
 
-        # 显式等待弹窗出现
-        wait = WebDriverWait(driver, 2)
-        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".nas-task-dialog")))
+def rename_target_name(old_name: str, prefix: str, pattern_config: RenameRules):
+    """按规则顺序匹配 old_name（一次扫描），返回新文件名；全部不匹配时返回 None。"""
+    return pattern_config.target_name(old_name, prefix)
 
-        # 找到输入框，输入磁力链接
-        input_box = driver.find_element(By.CSS_SELECTOR, ".el-textarea__inner")
-        input_box.send_keys(link)
 
-        # 找到确认按钮
-        confirm_btn = driver.find_element(By.CSS_SELECTOR, ".el-dialog__footer .el-button.el-button--primary.task-parse-btn")
-        confirm_btn.click()
+RENAME_WORKERS = 4            # 递归重命名时同时处理的文件夹数
+RENAME_FOLDER_FIELD = "{folder}"  # 前缀中的这个占位符换成文件所在文件夹的名称
+RENAME_TEMP_SUFFIX = ".renaming"  # 循环改名（如 E01 <-> E02）时中转用的临时名后缀
+RENAME_NOREPLACE = 1              # linux/fs.h：目标已存在时 renameat2 直接失败，不覆盖
+AT_FDCWD = -100
 
-        # 等一下解析完（这里简单等待 1 秒，可根据页面加载情况调整）
-        time.sleep(1)
 
-        # 点击下载按钮
-        download_btn = driver.find_element(By.CSS_SELECTOR, ".result-nas-task-dialog_footer .el-button.el-button--primary.task-parse-btn")
-        download_btn.click()
+@functools.lru_cache(maxsize=None)
+def _libc_renameat2():
+    """返回 libc 中的 renameat2（glibc 2.28+）；不是 Linux 或找不到时返回 None。"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        renameat2 = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    return renameat2
 
-        # 等待一些时间，或在此处做更多校验
-        time.sleep(1)
-    driver.quit()
 
-    return f"已处理 {len(magnet_links)} 条磁力链接！"
+def rename_no_replace(src: str, dst: str):
+    """
+    重命名但绝不覆盖已有文件，目标已存在时抛出 FileExistsError。
+    Windows 的 os.rename 本身就不覆盖；Linux 上用 renameat2(RENAME_NOREPLACE) 一次调用完成检查与改名，
+    文件系统不支持时（部分网络挂载）退回“先检查再改名”。
+    """
+    if os.name == "nt":
+        os.rename(src, dst)
+        return
+    renameat2 = _libc_renameat2()
+    if renameat2 is not None:
+        if renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+        err = ctypes.get_errno()
+        if err not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+            raise OSError(err, os.strerror(err), src, None, dst)
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "目标已存在", dst)
+    os.rename(src, dst)
 
 
-# ---------------------- (2) 文件处理工具逻辑 ----------------------
-def move_files_with_keyword_in_subfolder(
-    root_folder: str,
-    keyword: str,
-    target_folder: str,
-    create_if_not_exists: bool = True,
-    recursive: bool = False,
-    preview: bool = True
-) -> str:
+def order_renames(pairs: list, existing: set):
     """
-    在 root_folder 下查找所有子文件夹(或子孙文件夹)：
-      - 若文件夹名称包含 keyword，则将其下所有文件移动到 target_folder。
-      - 如果 preview=True，则仅打印操作，不执行移动。
+    给一批重命名 (旧路径, 新路径) 排出安全的执行顺序，只在内存里做哈希比对，不碰磁盘。
+    existing 为相关目录里现有的全部路径（文件与文件夹）。
+    - 多个文件要改成同一个名字：这几个全部跳过；
+    - 新名字被不参与本批重命名的文件 / 文件夹占着：跳过；被跳过的文件留在原地，
+      等着它腾出名字的重命名也会连带跳过；
+    - A -> B、B -> C 这样的链从链尾开始改；E01 <-> E02 这样的循环先把其中一个改成临时名，
+      其余依次改完后再从临时名改回。
+    返回 (steps, conflicts)：steps 为按顺序执行的 (源, 目标, 说明)，conflicts 为跳过原因。
     """
-    logs = []
+    key = os.path.normcase
+    conflicts = []
+    wanted = collections.OrderedDict()  # 新路径 -> 想改成它的 (旧路径, 新路径)
+    for src, dst in pairs:
+        if src != dst:
+            wanted.setdefault(key(dst), []).append((src, dst))
 
-    if not preview and create_if_not_exists and not os.path.exists(target_folder):
-        try:
-            os.makedirs(target_folder)
-            logs.append(f"[INFO] 已创建目标文件夹: {target_folder}")
-        except Exception as e:
-            logs.append(f"[ERROR] 无法创建目标文件夹: {target_folder}, 错误原因: {e}")
-            return "\n".join(logs)
-
-    def move_or_preview(file_path, dest_folder):
-        filename = os.path.basename(file_path)
-        dest_path = os.path.join(dest_folder, filename)
-        if preview:
-            logs.append(f"[预览] 将移动: {file_path} -> {dest_path}")
+    by_src = collections.OrderedDict()  # 旧路径 -> (旧路径, 新路径)
+    for group in wanted.values():
+        if len(group) > 1:
+            names = "、".join(os.path.basename(src) for src, _ in group)
+            conflicts.append(f"{names} 都会重命名为 {os.path.basename(group[0][1])}")
         else:
-            try:
-                shutil.move(file_path, dest_path)
-                os.chmod(dest_path, 0o777)
-                os.chmod(target_folder, 0o777)
-                logs.append(f"[移动成功] {file_path} -> {dest_path}")
-            except Exception as e:
-                logs.append(f"[移动失败] {file_path} -> {dest_path}, 原因: {e}")
+            by_src[key(group[0][0])] = group[0]
+    target_of = {key(dst): k for k, (_, dst) in by_src.items()}  # 新路径 -> 想占用它的旧路径
 
-    if recursive:
-        for dirpath, _, filenames in os.walk(root_folder):
-            folder_name = os.path.basename(dirpath)
-            if keyword in folder_name:
-                for file in filenames:
-                    source_path = os.path.join(dirpath, file)
-                    if os.path.isfile(source_path):
-                        move_or_preview(source_path, target_folder)
-    else:
-        try:
-            sub_dirs = os.listdir(root_folder)
-        except Exception as e:
-            logs.append(f"[ERROR] 无法访问目录: {root_folder}, 错误原因: {e}")
-            return "\n".join(logs)
+    # 目标被占且占用者不会让位的，逐个剔除；剔除的文件留在原地，又会挡住想改成它的那个
+    taken = {key(path) for path in existing}
+    blocked = [k for k, (_, dst) in by_src.items() if key(dst) != k and key(dst) in taken and key(dst) not in by_src]
+    while blocked:
+        k = blocked.pop()
+        if k not in by_src:
+            continue
+        src, dst = by_src.pop(k)
+        conflicts.append(f"{os.path.basename(src)} -> {os.path.basename(dst)}：目标已存在")
+        if target_of.get(k) in by_src:
+            blocked.append(target_of[k])
 
-        for name in sub_dirs:
-            subfolder_path = os.path.join(root_folder, name)
-            if os.path.isdir(subfolder_path) and (keyword in name):
-                for file in os.listdir(subfolder_path):
-                    source_path = os.path.join(subfolder_path, file)
-                    if os.path.isfile(source_path):
-                        move_or_preview(source_path, target_folder)
+    steps, done = [], set()
 
-    return "\n".join(logs)
+    def walk(k, note=""):
+        # 先改 k，再改等着 k 原名的那个，一直往前直到链头
+        while k is not None and k not in done:
+            done.add(k)
+            src, dst = by_src[k]
+            steps.append((src, dst, note))
+            note = ""
+            k = target_of.get(k) if target_of.get(k) in by_src else None
 
+    for k, (_, dst) in by_src.items():
+        if key(dst) == k or key(dst) not in by_src:  # 链尾：目标是空位（或只改大小写）
+            walk(k)
+    # 剩下的都在循环里
+    used = taken | set(target_of)
+    for k, (src, dst) in by_src.items():
+        if k in done:
+            continue
+        temp = src + RENAME_TEMP_SUFFIX
+        while key(temp) in used:
+            temp += RENAME_TEMP_SUFFIX
+        used.add(key(temp))
+        done.add(k)
+        steps.append((src, temp, "循环改名，先改为临时名"))
+        walk(target_of[k])
+        steps.append((temp, dst, "循环改名，从临时名改回"))
+    return steps, conflicts
 
-DEFAULT_PATTERN_CONFIG = [
-    {
-        "name": "提取 EP 后面的数字",
-        "pattern": r"EP(\d+)",
-        "rename_func": lambda m: m.group(1),
-    },
-    {
-        "name": "提取第一个数字串",
-        "pattern": r"(\d+)",
-        "rename_func": lambda m: m.group(1),
-    },
-]
 
-def rename_files(
+def plan_rename_files(
     folder_path: str,
     prefix: str = "NewFile_",
-    preview: bool = True,
-    custom_pattern: str = ""
-) -> str:
+    custom_pattern: str = "",
+    recursive: bool = False,
+    max_depth: int = 0,
+    exclude: str = ""
+) -> FileOpPlan:
     """
-    在 folder_path 下批量重命名文件。
+    扫描 folder_path 下的文件，按规则生成重命名计划。
     1. 如果 custom_pattern 非空，优先尝试匹配；
     2. 若匹配失败，再用后续默认规则；
-    3. 如果全部都不匹配则跳过。
+    3. 如果全部都不匹配则跳过（记录在 plan.notes 中）；
+    4. 重名（多个文件改成同一名字、或新名字已被其他文件占用）的跳过，见 order_renames。
+    recursive=True 时对 folder_path 及其下每个子文件夹分别生成计划（max_depth / exclude 见 iter_matching_dirs）；
+    prefix 中的 {folder} 会换成文件所在文件夹的名称。
     """
-    logs = []
-    
-    pattern_config = []
-    if custom_pattern.strip():
-        try:
-            re.compile(custom_pattern.strip())
-            pattern_config.append({
-                "name": "自定义规则",
-                "pattern": custom_pattern.strip(),
-                "rename_func": lambda m: m.group(1),
-            })
-        except re.error as e:
-            logs.append(f"自定义正则无效: {custom_pattern}, 错误原因: {e}")
+    plan = FileOpPlan("rename", {
+        "folder_path": folder_path,
+        "prefix": prefix,
+        "custom_pattern": custom_pattern,
+        "recursive": bool(recursive),
+        "max_depth": int(max_depth or 0),
+        "exclude": exclude or "",
+    })
+    pattern_config = build_pattern_config(custom_pattern, plan.notes)
 
-    pattern_config.extend(DEFAULT_PATTERN_CONFIG)
+    if recursive:
+        # 每个文件夹各列一次；文件夹名冲突由执行时重新读目录兜底
+        existing = set()
+        for folder, _, files in iter_matching_dirs(folder_path, lambda name: True, recursive=True,
+                                                   max_depth=max_depth, exclude=exclude,
+                                                   include_root=True, notes=plan.notes):
+            existing.update(entry.path for entry in files)
+            plan_rename_folder(plan, folder_path, folder, files, prefix, pattern_config)
+        plan.items.sort(key=lambda item: item["src"])  # 同一文件夹的排在一起，预览按路径排序
+        if not plan.items and not existing:
+            plan.notes.append(f"文件夹 {folder_path} 及其子文件夹下没有任何文件。")
+        drop_rename_conflicts(plan, existing)
+        return plan
 
-    if not os.path.isdir(folder_path):
-        logs.append(f"错误：文件夹不存在或路径无效: {folder_path}")
-        return "\n".join(logs)
+    try:
+        dirs, files = scan_dir(folder_path)
+    except OSError:
+        plan.notes.append(f"错误：文件夹不存在或路径无效: {folder_path}")
+        return plan
 
-    file_list = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-    if not file_list:
-        logs.append(f"文件夹 {folder_path} 下没有任何文件。")
-        return "\n".join(logs)
+    if not files:
+        plan.notes.append(f"文件夹 {folder_path} 下没有任何文件。")
+        return plan
 
-    file_list.sort()
+    plan_rename_folder(plan, folder_path, folder_path, files, prefix, pattern_config)
+    drop_rename_conflicts(plan, {entry.path for entry in dirs + files})
+    return plan
 
-    rename_pairs = []
-    for old_name in file_list:
-        old_path = os.path.join(folder_path, old_name)
-        _, ext = os.path.splitext(old_name)
-
-        new_suffix = None
-        for rule in pattern_config:
-            match_obj = re.search(rule["pattern"], old_name)
-            if match_obj:
-                new_suffix = rule["rename_func"](match_obj)
-                break
-
-        if not new_suffix:
-            logs.append(f"跳过：文件名不符合任何规则 -> {old_name}")
+
+def folder_prefix(prefix: str, folder: str) -> str:
+    """把前缀中的 {folder} 换成文件夹名称（其余内容原样保留）。"""
+    return prefix.replace(RENAME_FOLDER_FIELD, os.path.basename(os.path.normpath(folder)))
+
+
+def plan_rename_folder(plan: FileOpPlan, root: str, folder: str, files: list, prefix: str, pattern_config: RenameRules):
+    """为一个文件夹里的文件生成重命名计划项（按文件名排序），跳过原因写入 plan.notes。"""
+    prefix = folder_prefix(prefix, folder)
+    for entry in sorted(files, key=lambda entry: entry.name):
+        shown = os.path.relpath(entry.path, root)
+        new_name = rename_target_name(entry.name, prefix, pattern_config)
+        if not new_name:
+            plan.notes.append(f"跳过：文件名不符合任何规则 -> {shown}")
+            continue
+        if new_name == entry.name:
+            plan.notes.append(f"跳过：已是目标名称 -> {shown}")
             continue
+        plan.add(entry.path, os.path.join(folder, new_name), entry)
+
+
+def drop_rename_conflicts(plan: FileOpPlan, existing: set):
+    """预览时就把会重名的重命名从计划里去掉，原因写入 plan.notes。"""
+    steps, conflicts = order_renames([(item["src"], item["dst"]) for item in plan.items], existing)
+    if conflicts:
+        plan.notes.extend(f"跳过（重名）：{conflict}" for conflict in conflicts)
+        kept = {src for src, _, _ in steps}
+        plan.items = [item for item in plan.items if item["src"] in kept]
+
+
+def group_by_folder(items: list) -> collections.OrderedDict:
+    """按所在文件夹把 (旧路径, 新路径) 分组，保持原有顺序。"""
+    groups = collections.OrderedDict()
+    for src, dst in items:
+        groups.setdefault(os.path.dirname(src), []).append((src, dst))
+    return groups
+
+
+def order_folder_renames(folder: str, pairs: list, logs: list) -> list:
+    """重新读一次 folder，按 order_renames 排好执行顺序，冲突写入 logs；目录读不了时返回空列表。"""
+    try:
+        existing = {os.path.join(folder, name) for name in os.listdir(folder)}
+    except OSError as e:
+        logs.append(f"[ERROR] 无法读取文件夹: {folder}, 错误原因: {e}")
+        return []
+    steps, conflicts = order_renames(pairs, existing)
+    logs.extend(f"跳过（重名）：{conflict}" for conflict in conflicts)
+    return steps
+
+
+def rename_in_folder(folder: str, pairs: list, journal: OperationJournal = None) -> list:
+    """在一个文件夹里按顺序执行重命名（每一步都不覆盖已有文件），返回这个文件夹的日志。"""
+    logs = []
+    for old_path, new_path, note in order_folder_renames(folder, pairs, logs):
+        note = f"（{note}）" if note else ""
+        try:
+            rename_no_replace(old_path, new_path)
+            if journal is not None:
+                journal.record("mv", old_path, new_path)
+            logs.append(f"已重命名: {os.path.basename(old_path)} -> {os.path.basename(new_path)}{note}")
+        except Exception as e:
+            logs.append(f"重命名失败: {os.path.basename(old_path)} -> {os.path.basename(new_path)}，错误原因: {e}")
+    return logs
+
+
+def run_folder_renames(groups: collections.OrderedDict, logs: list, workers: int = RENAME_WORKERS,
+                       journal: OperationJournal = None):
+    """
+    各文件夹之间的重命名互不影响：交给线程池按文件夹并行执行，日志按文件夹顺序合并到 logs。
+    涉及多个文件夹时，每个文件夹的日志前加一行 [目录]。
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(workers or 1))) as pool:
+        results = pool.map(lambda group: rename_in_folder(*group, journal), groups.items())
+        for folder, folder_logs in zip(groups, results):
+            if len(groups) > 1:
+                logs.append(f"[目录] {folder}")
+            logs.extend(folder_logs)
 
-        new_name = f"{prefix}{new_suffix}{ext}"
-        new_path = os.path.join(folder_path, new_name)
-        rename_pairs.append((old_path, new_path))
+
+def rename_files(
+    folder_path: str,
+    prefix: str = "NewFile_",
+    preview: bool = True,
+    custom_pattern: str = "",
+    recursive: bool = False,
+    max_depth: int = 0,
+    exclude: str = "",
+    workers: int = RENAME_WORKERS,
+    plan: FileOpPlan = None
+) -> str:
+    """
+    在 folder_path 下批量重命名文件（匹配规则见 plan_rename_files）。
+    传入预览时得到的 plan（且参数一致）时直接按计划执行，执行前逐个确认文件未变化。
+    执行前每个文件夹重新读一次目录，按 order_renames 排好顺序（链从尾部改起、循环经临时名中转），每一步都不覆盖已有文件。
+    recursive=True 时整个片库一起处理：按文件夹分组，workers 个文件夹并行重命名，日志按文件夹合并。
+    每一步（含循环改名的临时名）都写入操作日志，可以一键撤销。
+    """
+    logs = []
+    plan = reuse_or_build_plan(
+        plan, "rename",
+        {"folder_path": folder_path, "prefix": prefix, "custom_pattern": custom_pattern, "recursive": bool(recursive),
+         "max_depth": int(max_depth or 0), "exclude": exclude or ""},
+        lambda: plan_rename_files(folder_path, prefix, custom_pattern, recursive, max_depth, exclude),
+        logs, preview
+    )
+    logs.extend(plan.notes)
+    if not plan.items:
+        return "\n".join(logs)
 
     if preview:
         logs.append("重命名预览:")
-        for old_path, new_path in rename_pairs:
-            logs.append(f"{os.path.basename(old_path)} -> {os.path.basename(new_path)}")
+        for item in plan.items:
+            logs.append(f"{os.path.relpath(item['src'], folder_path)} -> {os.path.basename(item['dst'])}")
         logs.append("\n(预览模式，未执行实际重命名)")
-    else:
-        for old_path, new_path in rename_pairs:
-            try:
-                os.rename(old_path, new_path)
-                logs.append(f"已重命名: {os.path.basename(old_path)} -> {os.path.basename(new_path)}")
-            except Exception as e:
-                logs.append(f"重命名失败: {os.path.basename(old_path)} -> {os.path.basename(new_path)}，错误原因: {e}")
+        return "\n".join(logs)
+
+    rename_pairs = []
+    for item in plan.items:
+        reason = FileOpPlan.changed(item)
+        if reason:
+            logs.append(f"跳过：{os.path.relpath(item['src'], folder_path)} {reason}")
+        else:
+            rename_pairs.append((item["src"], item["dst"]))
 
+    with OperationJournal.begin("rename", f"重命名 {folder_path} 下的文件（前缀 {prefix}）") as journal:
+        run_folder_renames(group_by_folder(rename_pairs), logs, workers, journal)
     return "\n".join(logs)
 
 
+def plan_delete_empty_folders(
+    root_folder: str,
+    keyword: str,
+    recursive: bool = False,
+    max_depth: int = 0,
+    exclude: str = "",
+    prune: bool = False
+) -> FileOpPlan:
+    """
+    找出 root_folder 下“名称含 keyword”且为空的子文件夹。
+    递归时从里往外检查：只包含“已计划删除的空文件夹”的文件夹同样视为空，按计划顺序依次删除即可。
+    max_depth / exclude / prune 见 iter_matching_dirs（剪枝后，命中文件夹里的空子文件夹不再单独检查）。
+    """
+    plan = FileOpPlan("delete", {
+        "root_folder": root_folder,
+        "keyword": keyword,
+        "recursive": bool(recursive),
+        "max_depth": int(max_depth or 0),
+        "exclude": exclude or "",
+        "prune": bool(prune),
+    })
+    planned = set()
+    if not os.path.isdir(root_folder):
+        plan.notes.append(f"[ERROR] 无效的 root_folder: {root_folder}")
+        return plan
+
+    def check(folder_to_check):
+        try:
+            with os.scandir(folder_to_check) as it:
+                empty = all(entry.path in planned for entry in it)
+            if empty:
+                plan.add(folder_to_check)
+                planned.add(folder_to_check)
+            else:
+                plan.notes.append(f"[跳过] 该文件夹不为空: {folder_to_check}")
+        except Exception as e:
+            plan.notes.append(f"[ERROR] 删除文件夹时出错: {folder_to_check}, 原因: {e}")
+
+    # 先自上而下找出命中的文件夹（可剪枝），再倒序检查：先序遍历倒过来，子文件夹一定排在父文件夹之前
+    matched = [folder for folder, _, _ in iter_matching_dirs(
+        root_folder, lambda name: (keyword in name) or None, recursive, max_depth, exclude, prune, notes=plan.notes
+    )]
+    for folder in reversed(matched):
+        check(folder)
+    return plan
+
+
 def delete_empty_folders_with_keyword(
     root_folder: str,
     keyword: str,
     recursive: bool = False,
-    preview: bool = True
+    preview: bool = True,
+    max_depth: int = 0,
+    exclude: str = "",
+    prune: bool = False,
+    plan: FileOpPlan = None
 ) -> str:
     """
     在 root_folder 下查找所有“名称含 keyword”的子文件夹，若该文件夹为空则删除。
+    传入预览时得到的 plan（且参数一致）时直接按计划删除。
     """
     logs = []
-    if not os.path.isdir(root_folder):
-        logs.append(f"[ERROR] 无效的 root_folder: {root_folder}")
-        return "\n".join(logs)
+    plan = reuse_or_build_plan(
+        plan, "delete",
+        {"root_folder": root_folder, "keyword": keyword, "recursive": bool(recursive),
+         "max_depth": int(max_depth or 0), "exclude": exclude or "", "prune": bool(prune)},
+        lambda: plan_delete_empty_folders(root_folder, keyword, recursive, max_depth, exclude, prune),
+        logs, preview
+    )
+    logs.extend(plan.notes)
 
-    if recursive:
-        for dirpath, dirnames, _ in os.walk(root_folder, topdown=False):
-            for d in dirnames:
-                if keyword in d:
-                    folder_to_check = os.path.join(dirpath, d)
-                    try:
-                        if not os.listdir(folder_to_check):
-                            if preview:
-                                logs.append(f"[预览] 将删除空文件夹: {folder_to_check}")
-                            else:
-                                os.rmdir(folder_to_check)
-                                logs.append(f"[删除成功] {folder_to_check}")
-                        else:
-                            logs.append(f"[跳过] 该文件夹不为空: {folder_to_check}")
-                    except Exception as e:
-                        logs.append(f"[ERROR] 删除文件夹时出错: {folder_to_check}, 原因: {e}")
-    else:
-        try:
-            sub_dirs = os.listdir(root_folder)
-        except Exception as e:
-            logs.append(f"[ERROR] 无法访问目录: {root_folder}, 错误原因: {e}")
-            return "\n".join(logs)
+    if preview:
+        for item in plan.items:
+            logs.append(f"[预览] 将删除空文件夹: {item['src']}")
+        return "\n".join(logs)
 
-        for d in sub_dirs:
-            folder_to_check = os.path.join(root_folder, d)
-            if os.path.isdir(folder_to_check) and (keyword in d):
-                try:
-                    if not os.listdir(folder_to_check):
-                        if preview:
-                            logs.append(f"[预览] 将删除空文件夹: {folder_to_check}")
-                        else:
-                            os.rmdir(folder_to_check)
-                            logs.append(f"[删除成功] {folder_to_check}")
-                    else:
-                        logs.append(f"[跳过] 该文件夹不为空: {folder_to_check}")
-                except Exception as e:
-                    logs.append(f"[ERROR] 删除文件夹时出错: {folder_to_check}, 原因: {e}")
+    with OperationJournal.begin("delete", f"删除 {root_folder} 中含“{keyword}”的空文件夹") as journal:
+        for item in plan.items:
+            folder_to_check = item["src"]
+            # os.rmdir 只会删除空文件夹：预览之后又放进了文件的文件夹会删除失败并记录在日志中
+            try:
+                os.rmdir(folder_to_check)
+                journal.record("rmdir", folder_to_check)
+                logs.append(f"[删除成功] {folder_to_check}")
+            except Exception as e:
+                logs.append(f"[ERROR] 删除文件夹时出错: {folder_to_check}, 原因: {e}")
 
     return "\n".join(logs)
 
@@ -289,17 +2832,552 @@ def preview_subfolders(root_folder: str) -> str:
         return "\n".join(logs)
 
     try:
-        sub_dirs = [d for d in os.listdir(root_folder) if os.path.isdir(os.path.join(root_folder, d))]
+        sub_dirs, _ = scan_dir(root_folder)
         logs.append(f"根目录: {root_folder} 下的子文件夹如下：")
         if not sub_dirs:
             logs.append("（无子文件夹）")
         for d in sub_dirs:
-            logs.append(f"- {d}")
+            logs.append(f"- {d.name}")
     except Exception as e:
         logs.append(f"[ERROR] 无法访问目录: {root_folder}, 错误原因: {e}")
     return "\n".join(logs)
 
 
+# 路由表：多部剧一次遍历归档
+ROUTING_TABLE_EXAMPLE = r"""# 每行一条规则：关键字 | 目标文件夹 | 重命名前缀(可空) | 重命名正则(可空)
+# 关键字以 re: 开头时按正则匹配文件夹名；前缀为空则只移动不重命名
+# 前缀两边只去掉紧挨 | 的一个空格，其余空格保留：前缀要以空格结尾时（如 "行尸走肉 - "）在 | 前写两个空格
+行尸走肉 | /DataBase/电视剧/行尸走肉 | 行尸走肉 - S | S(\d+E\d+)
+re:^The[ .]Office | /DataBase/电视剧/The Office | The Office - S | S(\d+E\d+)"""
+
+class RoutingTable:
+    """
+    多条路由规则：文件夹名 -> (目标文件夹, 重命名前缀, 重命名正则)。
+    所有规则合并成一个带命名分组的正则，遍历时每个文件夹名只匹配一次，而不是逐条规则做子串判断。
+    同一文件夹名命中多条规则时，取在名称中最先出现的那条；出现位置相同则取表中靠前的。
+    """
+
+    def __init__(self, routes: list):
+        self.routes = routes
+        parts = [
+            f"(?P<_route{i}>{route['match'] if route['is_regex'] else re.escape(route['match'])})"
+            for i, route in enumerate(routes)
+        ]
+        self._combined = re.compile("|".join(parts)) if parts else None
+
+    @classmethod
+    def single(cls, keyword: str, target_folder: str, prefix: str = "", custom_pattern: str = ""):
+        """只有一条规则的路由表，对应原来的“关键字 + 目标文件夹 (+ 前缀与正则)”用法。"""
+        return cls([{
+            "match": keyword,
+            "is_regex": False,
+            "target_folder": target_folder,
+            "prefix": prefix,
+            "pattern_config": build_pattern_config(custom_pattern) if prefix else None,
+        }])
+
+    def match(self, folder_name: str):
+        """返回 folder_name 命中的规则，没有命中时返回 None。"""
+        m = self._combined.search(folder_name) if self._combined is not None else None
+        if m is None:
+            return None
+        for i, route in enumerate(self.routes):
+            if m.start(f"_route{i}") != -1:
+                return route
+        return None
+
+    @staticmethod
+    def target_path(route: dict, file_name: str) -> str:
+        """文件在该规则下的最终路径：按规则重命名，文件名不匹配重命名正则时保留原名。"""
+        new_name = None
+        if route["pattern_config"] is not None:
+            new_name = rename_target_name(file_name, route["prefix"], route["pattern_config"])
+        return os.path.join(route["target_folder"], new_name or file_name)
+
+
+def route_prefix(field: str, followed_by_pattern: bool) -> str:
+    """
+    路由表的前缀列只去掉分隔用的空格（开头一个；后面还有正则列时结尾一个），其余空格原样保留，
+    "ShowA | 目标 | ShowA -  | E(\\d+)" 得到前缀 "ShowA - "。只有空格时视为没有前缀。
+    """
+    if field.startswith(" "):
+        field = field[1:]
+    if followed_by_pattern and field.endswith(" "):
+        field = field[:-1]
+    return field if field.strip() else ""
+
+
+def parse_routing_table(text: str):
+    """
+    解析界面上填写的路由表（格式见 ROUTING_TABLE_EXAMPLE），返回 (RoutingTable, 错误列表)。
+    关键字列的正则里不能出现 "|"（需要“或”时拆成多条规则），重命名正则列不受此限制。
+    """
+    routes, errors = [], []
+    for lineno, line in enumerate((text or "").splitlines(), 1):
+        if not line.strip() or line.strip().startswith("#"):
+            continue
+        fields = line.split("|", 3)
+        # 关键字、目标文件夹、正则两边的空格都去掉；前缀见 route_prefix
+        fields[:2] = [field.strip() for field in fields[:2]]
+        fields[3:] = [field.strip() for field in fields[3:]]
+        if len(fields) < 2 or not fields[0] or not fields[1]:
+            errors.append(f"第 {lineno} 行格式错误（至少需要“关键字 | 目标文件夹”）: {line.strip()}")
+            continue
+        match, is_regex = fields[0], fields[0].startswith("re:")
+        if is_regex:
+            match = match[3:]
+            try:
+                re.compile(match)
+            except re.error as e:
+                errors.append(f"第 {lineno} 行的正则无效: {match}, 错误原因: {e}")
+                continue
+        prefix = route_prefix(fields[2], len(fields) > 3) if len(fields) > 2 else ""
+        notes = []
+        pattern_config = build_pattern_config(fields[3] if len(fields) > 3 else "", notes) if prefix else None
+        errors.extend(f"第 {lineno} 行: {note}" for note in notes)
+        routes.append({
+            "match": match,
+            "is_regex": is_regex,
+            "target_folder": fields[1],
+            "prefix": prefix,
+            "pattern_config": pattern_config,
+        })
+    try:
+        return RoutingTable(routes), errors
+    except re.error as e:
+        # 每条正则单独有效，合并后仍可能出错（例如用了按序号的反向引用 \1）
+        errors.append(f"规则合并失败: {e}")
+        return RoutingTable([]), errors
+
+
+def plan_routed_moves(root_folder: str, routing_table: str, recursive: bool = False,
+                      max_depth: int = 0, exclude: str = "", prune: bool = False) -> FileOpPlan:
+    """
+    按路由表遍历一次 root_folder：命中规则的文件夹下的文件，
+    直接计划移动到该规则的目标文件夹并按规则重命名（移动与重命名一步完成）。
+    max_depth / exclude / prune 见 iter_matching_dirs。
+    """
+    plan = FileOpPlan("route", {
+        "root_folder": root_folder,
+        "routing_table": routing_table,
+        "recursive": bool(recursive),
+        "max_depth": int(max_depth or 0),
+        "exclude": exclude or "",
+        "prune": bool(prune),
+    })
+    table, errors = parse_routing_table(routing_table)
+    plan.notes.extend(f"[ERROR] {error}" for error in errors)
+    if not table.routes:
+        plan.notes.append("[ERROR] 路由表中没有可用的规则")
+        return plan
+
+    for _, route, files in iter_matching_dirs(root_folder, table.match, recursive, max_depth, exclude, prune,
+                                              include_root=recursive, notes=plan.notes):
+        for file in files:
+            plan.add(file.path, table.target_path(route, file.name), file)
+    drop_move_conflicts(plan)
+    return plan
+
+
+def drop_move_conflicts(plan: FileOpPlan):
+    """
+    预览时就去掉会覆盖文件的移动，原因写入 plan.notes：
+    - 目标文件夹里已有同名文件 / 文件夹（每个目标文件夹只读一次）；
+    - 同一批里多个文件要移到同一路径：这几个全部跳过（与 order_renames 相同）。
+    """
+    counts = collections.Counter(os.path.normcase(item["dst"]) for item in plan.items)
+    listings, kept = {}, []
+    for item in plan.items:
+        folder = os.path.dirname(item["dst"])
+        if folder not in listings:
+            try:
+                listings[folder] = {os.path.normcase(name) for name in os.listdir(folder)}
+            except OSError:
+                listings[folder] = set()  # 目标文件夹还不存在，执行时再创建
+        count = counts[os.path.normcase(item["dst"])]
+        if count > 1:
+            plan.notes.append(f"跳过（重名）：{item['src']} -> {item['dst']}，本批有 {count} 个文件要移到这个路径")
+        elif os.path.normcase(os.path.basename(item["dst"])) in listings[folder]:
+            plan.notes.append(f"跳过（重名）：{item['src']} -> {item['dst']}，目标已存在")
+        else:
+            kept.append(item)
+    plan.items = kept
+
+
+def route_files(
+    root_folder: str,
+    routing_table: str,
+    recursive: bool = False,
+    preview: bool = True,
+    workers: int = MOVE_WORKERS,
+    progress: MoveProgress = None,
+    max_depth: int = 0,
+    exclude: str = "",
+    prune: bool = False,
+    action: str = "move",
+    plan: FileOpPlan = None
+) -> str:
+    """
+    按路由表一次归档多部剧：每条规则 = 关键字(或正则) -> 目标文件夹 + 重命名前缀与正则。
+    - 只遍历一次目录树，文件直接移到各自规则下重命名后的路径；
+    - 预览 / 复用计划 / 并行移动的行为与 move_files_with_keyword_in_subfolder 相同；
+    - action="link" 时改为归档（硬链接 / reflink / 复制），源文件保留。
+    返回执行/预览日志。
+    """
+    logs = []
+    plan = reuse_or_build_plan(
+        plan, "route",
+        {"root_folder": root_folder, "routing_table": routing_table, "recursive": bool(recursive),
+         "max_depth": int(max_depth or 0), "exclude": exclude or "", "prune": bool(prune)},
+        lambda: plan_routed_moves(root_folder, routing_table, recursive, max_depth, exclude, prune),
+        logs, preview
+    )
+    logs.extend(plan.notes)
+
+    if preview:
+        for item in plan.items:
+            logs.append(f"[预览] 将{MOVE_ACTIONS[action]}: {item['src']} -> {item['dst']}")
+        return "\n".join(logs)
+
+    with OperationJournal.begin("route", f"按路由表{MOVE_ACTIONS[action]} {root_folder}") as journal:
+        # 各条规则的目标文件夹按需创建
+        for folder in sorted({os.path.dirname(item["dst"]) for item in plan.items}):
+            if not os.path.isdir(folder):
+                try:
+                    make_dirs(folder, journal)
+                    logs.append(f"[INFO] 已创建目标文件夹: {folder}")
+                except Exception as e:
+                    logs.append(f"[ERROR] 无法创建目标文件夹: {folder}, 错误原因: {e}")
+
+        run_planned_moves(plan.items, logs, workers, progress, action=action, journal=journal)
+    return "\n".join(logs)
+
+
+# 监控模式：下载完成的文件自动移动并重命名（inotify / 轮询）
+WATCH_POLL_INTERVAL = 10      # 轮询模式下检查目录的间隔(秒)
+WATCH_SETTLE_SECONDS = 30     # 文件在这么长时间内没有任何变化，才认为下载完成
+WATCH_LOG_LINES = 200         # 界面上保留的监控日志行数
+# 迅雷及常见下载器的未完成文件后缀；以 "." 开头的隐藏文件也一律忽略
+XUNLEI_TEMP_SUFFIXES = (".xltd", ".xlcfg", ".xltmp", ".downloading", ".part", ".tmp", ".!ut", MOVE_PARTIAL_SUFFIX)
+NETWORK_FS_TYPES = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "fuse.sshfs", "9p"}
+
+
+def is_download_temp_file(name: str) -> bool:
+    return name.startswith(".") or name.lower().endswith(XUNLEI_TEMP_SUFFIXES)
+
+
+def is_network_filesystem(path: str) -> bool:
+    """根据 /proc/mounts 判断 path 是否位于网络文件系统上（这类挂载收不到 inotify 事件）。"""
+    try:
+        with open("/proc/mounts", "r", encoding="utf-8", errors="ignore") as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return False
+    real = os.path.realpath(path)
+    best, best_type = "", ""
+    for mount_point, fs_type in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        if (real == mount_point or real.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+            best, best_type = mount_point, fs_type
+    return best_type in NETWORK_FS_TYPES
+
+
+class InotifyEvents:
+    """
+    通过 ctypes 调用 Linux inotify（无需额外依赖）。
+    read() 返回 [(路径, 是否目录, 是否队列溢出)]；非 Linux 或调用失败时构造函数抛出 OSError。
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("当前系统不支持 inotify")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self._dirs = {}
+
+    def add_dir(self, path: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监控目录: {path}")
+        self._dirs[wd] = path
+
+    def read(self, timeout: float) -> list:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + self._HEADER.size <= len(data):
+            wd, mask, _, length = self._HEADER.unpack_from(data, offset)
+            raw_name = data[offset + self._HEADER.size: offset + self._HEADER.size + length]
+            offset += self._HEADER.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                events.append(("", False, True))
+                continue
+            if mask & self.IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            folder = self._dirs.get(wd)
+            name = os.fsdecode(raw_name.rstrip(b"\0"))
+            if folder and name:
+                events.append((os.path.join(folder, name), bool(mask & self.IN_ISDIR), False))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class DownloadFolderWatcher(threading.Thread):
+    """
+    监控迅雷下载根目录：命中路由表规则（单个关键字即只有一条规则）的文件夹里出现下载完成的文件时，
+    用与批量处理相同的逻辑（move_one_file / RoutingTable.target_path）把它移到该规则的目标文件夹并重命名。
+    - Linux 本地磁盘上使用 inotify，事件驱动；
+    - 其他情况（Windows、SMB/NFS 挂载）使用轮询：每次只 stat 已知目录，目录 mtime 变化时才重新列目录；
+    - 文件在 WATCH_SETTLE_SECONDS 内大小与修改时间都不再变化才处理，迅雷的临时文件一律忽略；
+    - 启动时目录里已有的文件同样按上述规则处理。
+    """
+
+    def __init__(self, root_folder: str, table: RoutingTable, recursive: bool = False, mode: str = "auto",
+                 poll_interval: float = WATCH_POLL_INTERVAL, settle_seconds: float = WATCH_SETTLE_SECONDS):
+        super().__init__(name="download-watcher", daemon=True)
+        self.root_folder = root_folder
+        self.table = table
+        self.recursive = recursive
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.mode = mode
+        self.filed = 0
+        self._logs = collections.deque(maxlen=WATCH_LOG_LINES)
+        self._pending = {}      # 文件路径 -> (最近一次变化的时间, 大小, mtime_ns)
+        self._dir_mtimes = {}   # 轮询模式下已知目录的 mtime_ns
+        self._stop_event = threading.Event()
+        self._inotify = None
+
+    # ---------- 日志 ----------
+    def log(self, message: str):
+        self._logs.append(f"{time.strftime('%H:%M:%S')} {message}")
+
+    def describe(self) -> str:
+        state = "运行中" if self.is_alive() else "已停止"
+        if len(self.table.routes) == 1:
+            route = self.table.routes[0]
+            rules = f"(关键字: {route['match']}) -> {route['target_folder']}"
+        else:
+            rules = f"(路由规则 {len(self.table.routes)} 条)"
+        header = (f"[监控{state}] {self.root_folder} {rules}，"
+                  f"方式: {'inotify' if self._inotify else '轮询'}，已归档 {self.filed} 个，等待完成 {len(self._pending)} 个")
+        return "\n".join([header] + list(self._logs))
+
+    def stop(self):
+        self._stop_event.set()
+
+    # ---------- 目录筛选 ----------
+    def _wanted_dir(self, folder: str) -> bool:
+        """folder 下的文件是否需要处理（与 plan_routed_moves 的规则一致）。"""
+        if self.table.match(os.path.basename(folder)) is None:
+            return False
+        return self.recursive or os.path.dirname(folder) == self.root_folder.rstrip("/\\")
+
+    def _tracked_dir(self, folder: str) -> bool:
+        """folder 是否需要跟踪（非递归时只跟踪根目录与第一层的匹配文件夹）。"""
+        return self.recursive or folder == self.root_folder or self._wanted_dir(folder)
+
+    def _note_file(self, path: str, st=None):
+        if is_download_temp_file(os.path.basename(path)):
+            return
+        try:
+            st = st or os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        previous = self._pending.get(path)
+        if previous is None or previous[1:] != (st.st_size, st.st_mtime_ns):
+            self._pending[path] = (time.monotonic(), st.st_size, st.st_mtime_ns)
+
+    def _scan_dir(self, folder: str):
+        """读一次目录：登记新出现的子目录与文件。返回子目录列表（供 inotify 加监控）。"""
+        try:
+            dirs, files = scan_dir(folder)
+        except OSError:
+            self._dir_mtimes.pop(folder, None)
+            return []
+        if self._wanted_dir(folder):
+            for entry in files:
+                self._note_file(entry.path)
+        return [d.path for d in dirs if not d.is_symlink() and self._tracked_dir(d.path)]
+
+    def _add_tree(self, folder: str):
+        """从 folder 开始登记整棵（需要跟踪的）子树；inotify 模式下同时加上监控。"""
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            if self._inotify is not None:
+                try:
+                    self._inotify.add_dir(current)
+                except OSError as e:
+                    self.log(f"[ERROR] {e}")
+            try:
+                self._dir_mtimes[current] = os.stat(current).st_mtime_ns
+            except OSError:
+                continue
+            stack.extend(self._scan_dir(current))
+
+    # ---------- 两种事件来源 ----------
+    def _poll_once(self):
+        for folder, known_mtime in list(self._dir_mtimes.items()):
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                self._dir_mtimes.pop(folder, None)
+                continue
+            if mtime == known_mtime:
+                continue
+            self._dir_mtimes[folder] = mtime
+            for sub in self._scan_dir(folder):
+                if sub not in self._dir_mtimes:
+                    self._add_tree(sub)
+
+    def _handle_inotify(self, events: list):
+        for path, is_dir, overflow in events:
+            if overflow:
+                # 事件队列溢出：整体重新登记一遍
+                self.log("[INFO] inotify 事件过多，重新扫描一次")
+                self._add_tree(self.root_folder)
+            elif is_dir:
+                if self._tracked_dir(path):
+                    self._add_tree(path)
+            elif self._wanted_dir(os.path.dirname(path)):
+                self._note_file(path)
+
+    # ---------- 处理已完成的文件 ----------
+    def _process_settled(self):
+        now = time.monotonic()
+        for path, (changed_at, size, mtime_ns) in list(self._pending.items()):
+            if now - changed_at < self.settle_seconds:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._pending.pop(path, None)
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self._pending[path] = (now, st.st_size, st.st_mtime_ns)
+                continue
+            self._pending.pop(path, None)
+            self._file_one(path)
+
+    def _file_one(self, path: str):
+        route = self.table.match(os.path.basename(os.path.dirname(path)))
+        if route is None:
+            return
+        final_path = RoutingTable.target_path(route, os.path.basename(path))
+        if os.path.exists(final_path):
+            self.log(f"[跳过] 目标已存在: {final_path}")
+            return
+        try:
+            os.makedirs(route["target_folder"], exist_ok=True)
+            # 移动与重命名一步完成：直接移到重命名后的路径
+            detail = move_one_file(path, final_path)
+            self.filed += 1
+            self.log(f"[自动归档] {path} -> {final_path}{f'（{detail}）' if detail else ''}")
+            for error in fix_permissions([final_path])[1]:
+                self.log(f"[ERROR] 修改权限失败: {error}")
+        except Exception as e:
+            self.log(f"[移动失败] {path} -> {final_path}, 原因: {e}")
+
+    def run(self):
+        use_inotify = self.mode == "inotify" or (self.mode == "auto" and not is_network_filesystem(self.root_folder))
+        if use_inotify:
+            try:
+                self._inotify = InotifyEvents()
+            except OSError as e:
+                self.log(f"[INFO] inotify 不可用（{e}），改用轮询")
+        self.log(f"[INFO] 开始监控，方式: {'inotify' if self._inotify else f'轮询（每 {self.poll_interval:g} 秒）'}")
+        self._add_tree(self.root_folder)
+        next_poll = time.monotonic() + self.poll_interval
+        try:
+            while not self._stop_event.is_set():
+                if self._inotify is not None:
+                    self._handle_inotify(self._inotify.read(timeout=1.0))
+                else:
+                    self._stop_event.wait(min(1.0, max(0.0, next_poll - time.monotonic())))
+                    if time.monotonic() >= next_poll:
+                        self._poll_once()
+                        next_poll = time.monotonic() + self.poll_interval
+                self._process_settled()
+        except Exception as e:
+            self.log(f"[ERROR] 监控异常退出: {e}")
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+            self.log("[INFO] 监控已停止")
+
+
+_WATCHER_LOCK = threading.Lock()
+_WATCHER = None
+
+
+def start_folder_watch(root_folder: str, keyword: str, target_folder: str, prefix: str = "",
+                       custom_pattern: str = "", recursive: bool = False, mode: str = "auto",
+                       routing_table: str = "") -> str:
+    """
+    启动（或以新参数重启）监控。prefix 为空时只移动不重命名。
+    routing_table 非空时按路由表归档，忽略 keyword / target_folder / prefix / custom_pattern。
+    """
+    global _WATCHER
+    if not os.path.isdir(root_folder):
+        return f"[ERROR] 无效的根目录: {root_folder}"
+    if routing_table and routing_table.strip():
+        table, errors = parse_routing_table(routing_table)
+        if errors or not table.routes:
+            return "\n".join(f"[ERROR] {error}" for error in errors or ["路由表中没有可用的规则"])
+    elif keyword:
+        table = RoutingTable.single(keyword, target_folder, prefix, custom_pattern)
+    else:
+        return "[ERROR] 请先填写文件夹名称关键字"
+    with _WATCHER_LOCK:
+        if _WATCHER is not None:
+            _WATCHER.stop()
+            _WATCHER.join(timeout=5)
+        _WATCHER = DownloadFolderWatcher(root_folder, table, recursive, mode)
+        _WATCHER.start()
+        watcher = _WATCHER
+    time.sleep(0.2)
+    return watcher.describe()
+
+
+def stop_folder_watch() -> str:
+    with _WATCHER_LOCK:
+        watcher = _WATCHER
+    if watcher is None:
+        return "[INFO] 当前没有运行中的监控"
+    watcher.stop()
+    watcher.join(timeout=5)
+    return watcher.describe()
+
+
+def folder_watch_status() -> str:
+    with _WATCHER_LOCK:
+        watcher = _WATCHER
+    return watcher.describe() if watcher is not None else "[INFO] 当前没有运行中的监控"
+
+
 # ---------------------- (3) 构建 Gradio 多Tab界面并运行 ----------------------
 def build_interface():
     with gr.Blocks() as demo:
@@ -313,15 +3391,49 @@ def build_interface():
                 placeholder="magnet:?xt=urn:btih:xxxx..."
             )
             server_addr = gr.Textbox(label="迅雷Docker地址", value="http://IP:Port", lines=1)
-            output_box = gr.Textbox(label="执行结果", lines=2)
+            submit_backend = gr.Radio(
+                label="提交方式（auto：先走 HTTP 接口，失败的再用 Selenium）",
+                choices=["auto", "http", "selenium"],
+                value="auto"
+            )
+            batch_size_input = gr.Slider(
+                label="Selenium 每个弹窗一次提交的链接数（1 = 逐条提交）",
+                minimum=1, maximum=50, step=1, value=SUBMIT_BATCH_SIZE
+            )
+            concurrency_input = gr.Slider(
+                label="并发数（每个并发使用一个独立的浏览器；结果仍按粘贴顺序显示）",
+                minimum=1, maximum=MAX_SUBMIT_WORKERS, step=1, value=DOWNLOAD_WORKERS
+            )
+            dedup_input = gr.Checkbox(label="跳过已提交过的磁力链接（按 infohash 去重）", value=True)
+            output_box = gr.Textbox(label="执行结果", lines=12)
 
             download_button = gr.Button("开始下载")
             download_button.click(
                 fn=start_download,
-                inputs=[magnet_input,server_addr],
-                outputs=output_box
+                inputs=[magnet_input, server_addr, submit_backend, batch_size_input, dedup_input, concurrency_input],
+                outputs=output_box,
+                concurrency_limit=None  # 实际提交在后台队列中进行，这里只是轮询进度，不必互相排队
+            )
+
+            with gr.Row():
+                retry_failed_input = gr.Checkbox(label="恢复时同时重试上次失败的链接", value=True)
+                resume_button = gr.Button("恢复未完成的批次（程序重启/浏览器崩溃后）")
+
+            def on_resume_click(retry_failed, request: gr.Request = None):
+                owner = getattr(request, "session_hash", None) or "default"
+                yield from resume_unfinished_downloads(retry_failed, owner)
+
+            resume_button.click(
+                fn=on_resume_click,
+                inputs=retry_failed_input,
+                outputs=output_box,
+                concurrency_limit=None
             )
 
+            pool_status_button = gr.Button("查看浏览器池状态（页面加载耗时 / 内存）")
+            pool_status_box = gr.Textbox(label="浏览器池状态", lines=4)
+            pool_status_button.click(fn=BROWSER_POOL.describe, inputs=None, outputs=pool_status_box)
+
         # ====== Tab 2: 文件处理工具 ======
         with gr.Tab("文件处理工具"):
             gr.Markdown("## 文件处理工具：移动 / 重命名 / 删除空文件夹")
@@ -334,6 +3446,10 @@ def build_interface():
                 )
                 keyword = gr.Textbox(label="文件夹名称关键字 (keyword)", value="Key", lines=1)
             target_folder = gr.Textbox(label="目标文件夹 (或重命名用)", value="/DataBase/电视剧/Name", lines=1)
+            with gr.Row():
+                max_depth = gr.Number(label="递归最多进入几层（0 = 不限）", value=0, precision=0)
+                prune_matched = gr.Checkbox(label="命中关键字的文件夹不再进入其子文件夹（更快）", value=False)
+                walk_exclude = gr.Textbox(label="递归时跳过的文件夹（通配符，逗号分隔）", value=WALK_EXCLUDE_DEFAULT, lines=1)
 
             # --- 2) 子文件夹预览功能 ---
             preview_subfolders_btn = gr.Button("预览子文件夹")
@@ -354,21 +3470,45 @@ def build_interface():
                 create_if_not_exists = gr.Checkbox(label="若目标文件夹不存在则创建", value=True)
                 recursive_move = gr.Checkbox(label="递归子文件夹", value=False)
                 preview_move = gr.Checkbox(label="预览模式 (只打印，不执行)", value=True)
+                move_workers = gr.Slider(1, 8, value=MOVE_WORKERS, step=1, label="同时移动的文件数")
+            move_action = gr.Radio(
+                choices=[("移动", "move"), ("硬链接 / reflink 归档（源文件保留继续做种，不行时复制）", "link")],
+                value="move",
+                label="移动方式（D 中的路由表归档同样适用）"
+            )
             move_button = gr.Button("执行移动")
             move_output = gr.Textbox(label="移动操作日志", lines=8)
+            move_plan = gr.State(None)  # 最近一次预览得到的计划，执行时直接复用
 
             def on_move_click(
                 root_folder_value, keyword_value, target_folder_value,
-                create_if_not_exists_value, recursive_value, preview_value
+                create_if_not_exists_value, recursive_value, preview_value, workers_value, action_value,
+                depth_value, exclude_value, prune_value, plan_state
             ):
-                return move_files_with_keyword_in_subfolder(
+                # 预览时扫描并把计划存进界面状态；执行时直接复用（参数变了会自动重新扫描）
+                if preview_value:
+                    plan = plan_move_files(root_folder_value, keyword_value, target_folder_value, recursive_value,
+                                           depth_value, exclude_value, prune_value)
+                else:
+                    plan = plan_from_state(plan_state)
+                # 移动在后台线程执行，这里定期刷新 bytes/s、files/s
+                progress = MoveProgress()
+                for text in run_with_progress(lambda: move_files_with_keyword_in_subfolder(
                     root_folder_value,
                     keyword_value,
                     target_folder_value,
                     create_if_not_exists_value,
                     recursive_value,
-                    preview_value
-                )
+                    preview_value,
+                    workers=int(workers_value),
+                    progress=progress,
+                    max_depth=depth_value,
+                    exclude=exclude_value,
+                    prune=prune_value,
+                    action=action_value,
+                    plan=plan
+                ), progress):
+                    yield text, (plan.to_dict() if preview_value else None)
 
             move_button.click(
                 fn=on_move_click,
@@ -378,32 +3518,52 @@ def build_interface():
                     target_folder,
                     create_if_not_exists,
                     recursive_move,
-                    preview_move
+                    preview_move,
+                    move_workers,
+                    move_action,
+                    max_depth,
+                    walk_exclude,
+                    prune_matched,
+                    move_plan
                 ],
-                outputs=move_output
+                outputs=[move_output, move_plan]
             )
 
             # --- B) 批量重命名 ---
             gr.Markdown("### B) 批量重命名")
             with gr.Row():
-                rename_prefix = gr.Textbox(label="重命名前缀", value="Name - S0E", lines=1)
-                custom_pattern = gr.Textbox(label="自定义正则(如 S(\\d+)E(\\d+))，需带捕获组 ( )", value="E(\\d+) ", lines=1)
+                rename_prefix = gr.Textbox(label="重命名前缀（{folder} = 所在文件夹名，可写 S{season:02}E{episode:02} 模板）", value="Name - S0E", lines=1)
+                custom_pattern = gr.Textbox(label="自定义正则(如 S(\\d+)E(\\d+))，需带捕获组 ( )；填 @episode 使用内置剧集解析", value="E(\\d+) ", lines=1)
+                recursive_rename = gr.Checkbox(label="递归整个片库（各文件夹并行）", value=False)
                 preview_rename = gr.Checkbox(label="预览模式(只打印，不执行)", value=True)
             rename_button = gr.Button("执行重命名")
             rename_output = gr.Textbox(label="重命名操作日志", lines=8)
+            rename_plan = gr.State(None)
 
-            def on_rename_click(prefix_value, preview_value, pattern_value, target_folder_value):
-                return rename_files(
+            def on_rename_click(prefix_value, preview_value, pattern_value, target_folder_value, recursive_value,
+                                depth_value, exclude_value, plan_state):
+                if preview_value:
+                    plan = plan_rename_files(target_folder_value, prefix_value, pattern_value, recursive_value,
+                                             depth_value, exclude_value)
+                else:
+                    plan = plan_from_state(plan_state)
+                text = rename_files(
                     folder_path=target_folder_value,
                     prefix=prefix_value,
                     preview=preview_value,
-                    custom_pattern=pattern_value
+                    custom_pattern=pattern_value,
+                    recursive=recursive_value,
+                    max_depth=depth_value,
+                    exclude=exclude_value,
+                    plan=plan
                 )
+                return text, (plan.to_dict() if preview_value else None)
 
             rename_button.click(
                 fn=on_rename_click,
-                inputs=[rename_prefix, preview_rename, custom_pattern, target_folder],
-                outputs=rename_output
+                inputs=[rename_prefix, preview_rename, custom_pattern, target_folder, recursive_rename,
+                        max_depth, walk_exclude, rename_plan],
+                outputs=[rename_output, rename_plan]
             )
 
             # --- C) 删除空文件夹 ---
@@ -413,26 +3573,120 @@ def build_interface():
                 preview_delete = gr.Checkbox(label="预览模式(只打印，不执行)", value=True)
             delete_button = gr.Button("执行删除")
             delete_output = gr.Textbox(label="删除操作日志", lines=8)
+            delete_plan = gr.State(None)
 
-            def on_delete_click(folder_value, keyword_value, recursive_value, preview_value):
-                return delete_empty_folders_with_keyword(
+            def on_delete_click(folder_value, keyword_value, recursive_value, preview_value,
+                                depth_value, exclude_value, prune_value, plan_state):
+                if preview_value:
+                    plan = plan_delete_empty_folders(folder_value, keyword_value, recursive_value,
+                                                     depth_value, exclude_value, prune_value)
+                else:
+                    plan = plan_from_state(plan_state)
+                text = delete_empty_folders_with_keyword(
                     root_folder=folder_value,
                     keyword=keyword_value,
                     recursive=recursive_value,
-                    preview=preview_value
+                    preview=preview_value,
+                    max_depth=depth_value,
+                    exclude=exclude_value,
+                    prune=prune_value,
+                    plan=plan
                 )
+                return text, (plan.to_dict() if preview_value else None)
 
             delete_button.click(
                 fn=on_delete_click,
-                inputs=[root_folder, keyword, recursive_del, preview_delete],
-                outputs=delete_output
+                inputs=[root_folder, keyword, recursive_del, preview_delete, max_depth, walk_exclude, prune_matched,
+                        delete_plan],
+                outputs=[delete_output, delete_plan]
+            )
+
+            # --- D) 路由表 ---
+            gr.Markdown("### D) 多部剧一次归档：路由表（移动 + 重命名一步完成）")
+            gr.Markdown("每行一条规则：`关键字 | 目标文件夹 | 重命名前缀 | 重命名正则`，整个目录树只遍历一次。")
+            routing_table = gr.Textbox(label="路由表", placeholder=ROUTING_TABLE_EXAMPLE, lines=6)
+            with gr.Row():
+                recursive_route = gr.Checkbox(label="递归子文件夹", value=False)
+                preview_route = gr.Checkbox(label="预览模式(只打印，不执行)", value=True)
+            route_button = gr.Button("执行路由归档")
+            route_output = gr.Textbox(label="路由归档日志", lines=8)
+            route_plan = gr.State(None)
+
+            def on_route_click(folder_value, table_value, recursive_value, preview_value, workers_value, action_value,
+                               depth_value, exclude_value, prune_value, plan_state):
+                if preview_value:
+                    plan = plan_routed_moves(folder_value, table_value, recursive_value,
+                                             depth_value, exclude_value, prune_value)
+                else:
+                    plan = plan_from_state(plan_state)
+                progress = MoveProgress()
+                for text in run_with_progress(lambda: route_files(
+                    folder_value, table_value, recursive_value, preview_value,
+                    workers=int(workers_value), progress=progress,
+                    max_depth=depth_value, exclude=exclude_value, prune=prune_value, action=action_value, plan=plan
+                ), progress):
+                    yield text, (plan.to_dict() if preview_value else None)
+
+            route_button.click(
+                fn=on_route_click,
+                inputs=[root_folder, routing_table, recursive_route, preview_route, move_workers, move_action,
+                        max_depth, walk_exclude, prune_matched, route_plan],
+                outputs=[route_output, route_plan]
+            )
+
+            # --- E) 监控模式 ---
+            gr.Markdown("### E) 监控模式：下载完成后自动移动并重命名")
+            gr.Markdown("使用上面的根目录 / 关键字 / 目标文件夹 / 重命名前缀与正则（或 D 中的路由表）；迅雷的未完成临时文件会被忽略。")
+            with gr.Row():
+                watch_use_routes = gr.Checkbox(label="按路由表归档", value=False)
+                watch_recursive = gr.Checkbox(label="递归子文件夹", value=False)
+                watch_rename = gr.Checkbox(label="移动后按前缀与正则重命名", value=True)
+                watch_mode = gr.Radio(
+                    choices=[("自动", "auto"), ("inotify", "inotify"), ("轮询", "poll")],
+                    value="auto",
+                    label="监控方式（SMB/NFS 挂载上自动改用轮询）"
+                )
+            with gr.Row():
+                watch_start_button = gr.Button("开始监控")
+                watch_stop_button = gr.Button("停止监控")
+                watch_status_button = gr.Button("刷新监控日志")
+            watch_output = gr.Textbox(label="监控日志", lines=10)
+
+            def on_watch_start(folder_value, keyword_value, target_value, prefix_value, pattern_value,
+                               recursive_value, rename_value, mode_value, use_routes_value, table_value):
+                return start_folder_watch(
+                    folder_value, keyword_value, target_value,
+                    prefix=prefix_value if rename_value else "",
+                    custom_pattern=pattern_value,
+                    recursive=recursive_value,
+                    mode=mode_value,
+                    routing_table=table_value if use_routes_value else ""
+                )
+
+            watch_start_button.click(
+                fn=on_watch_start,
+                inputs=[root_folder, keyword, target_folder, rename_prefix, custom_pattern,
+                        watch_recursive, watch_rename, watch_mode, watch_use_routes, routing_table],
+                outputs=watch_output
             )
+            watch_stop_button.click(fn=stop_folder_watch, inputs=None, outputs=watch_output)
+            watch_status_button.click(fn=folder_watch_status, inputs=None, outputs=watch_output)
+
+            # --- F) 撤销 ---
+            gr.Markdown("### F) 撤销上一次操作")
+            gr.Markdown("A–D 实际执行的每一步都记在 `operation_journal/` 中，撤销时按记录倒序恢复，不重新扫描目录；"
+                        "再点一次撤销再往前的一次（监控模式的自动归档不记录）。")
+            undo_button = gr.Button("撤销上一次操作")
+            undo_output = gr.Textbox(label="撤销日志", lines=8)
+            undo_button.click(fn=lambda: undo_last_operation(), inputs=None, outputs=undo_output)
 
     return demo
 
 
 def main():
     demo = build_interface()
+    # 迅雷地址要等用户填写，这里只提前启动 Chrome；第一次点击时再打开页面
+    warm_up_browser_pool()
     demo.launch(server_name="0.0.0.0", server_port=7861, show_error=True)
 
 
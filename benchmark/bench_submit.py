@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+磁力提交性能测试：在本地模拟的迅雷页面（mock_xunlei.py）上比较各种提交方式。
+
+每种方式输出：成功数、吞吐(links/s)、单条延迟 p50/p99、峰值内存（本进程 + Chrome 进程树）。
+批量弹窗模式下，单条延迟为整批耗时按条数平摊。
+
+    python benchmark/bench_submit.py --links 200 --parse-delay 0.2
+    python benchmark/bench_submit.py --strategies http-c1 http-c4 selenium-c1 selenium-batch10-c1
+    python benchmark/bench_submit.py --save-baseline bench_baseline.json
+    python benchmark/bench_submit.py --baseline bench_baseline.json      # 与基线对比
+
+策略写法: <http|selenium|auto>[-batch<N>]-c<并发数>，例如 selenium-batch10-c2。
+本机没有 Chrome 时，Selenium 相关的策略会被标记为跳过。
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from mock_xunlei import MockXunleiServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATHS = {
+    "windows": os.path.join(REPO_ROOT, "app.py"),
+    "docker": os.path.join(REPO_ROOT, "Docker", "app.py"),
+}
+DEFAULT_STRATEGIES = [
+    "http-c1", "http-c2", "http-c4",
+    "selenium-c1", "selenium-c2", "selenium-c4",
+    "selenium-batch10-c1",
+]
+STRATEGY_PATTERN = re.compile(r"^(http|selenium|auto)(?:-batch(\d+))?-c(\d+)$")
+
+
+def load_app(which: str):
+    """按文件路径加载 app.py（两个版本都没有打包成模块）。"""
+    spec = importlib.util.spec_from_file_location(f"xunlei_app_{which}", APP_PATHS[which])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_links(count: int) -> list:
+    return [f"magnet:?xt=urn:btih:{hashlib.sha1(str(i).encode()).hexdigest()}&dn=bench-{i}" for i in range(count)]
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class MemorySampler:
+    """后台定期采样本进程及其子进程（chromedriver / Chrome）的 RSS，记录峰值。"""
+
+    def __init__(self, app, interval: float = 0.1):
+        self.app = app
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss = self.app.process_tree_rss(os.getpid())
+        if rss is None:
+            try:
+                import resource
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            except ImportError:
+                rss = 0
+        self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def run_strategy(app, server: MockXunleiServer, strategy: str, links: list, jobs_dir: str) -> dict:
+    match = STRATEGY_PATTERN.match(strategy)
+    if not match:
+        raise ValueError(f"无法识别的策略: {strategy}")
+    backend, batch, concurrency = match.group(1), int(match.group(2) or 1), int(match.group(3))
+
+    if backend != "http":
+        # 先把浏览器池预热到目标并发数，测的是常驻浏览器下的稳定吞吐
+        try:
+            app.BROWSER_POOL.ensure_size(concurrency)
+            app.BROWSER_POOL.warm_up(server.url, concurrency)
+        except Exception as e:
+            return {"strategy": strategy, "skipped": f"Chrome 不可用: {str(e).splitlines()[0]}"}
+
+    server.reset()
+    queue = app.DownloadJobQueue(workers=1, jobs_dir=jobs_dir)
+    with MemorySampler(app) as sampler:
+        start = time.monotonic()
+        job = queue.submit("bench", server.url, links, backend, batch, dedup=False, concurrency=concurrency)
+        job.done.wait()
+        wall = time.monotonic() - start
+    results = job.snapshot()
+
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["elapsed"] for r in ok]
+    return {
+        "strategy": strategy,
+        "links": len(links),
+        "ok": len(ok),
+        "created_on_mock": len(server.created_links),
+        "wall_s": wall,
+        "links_per_s": len(ok) / wall if wall > 0 else 0.0,
+        "p50_s": percentile(latencies, 0.50),
+        "p99_s": percentile(latencies, 0.99),
+        "peak_rss_mb": sampler.peak / 1024 / 1024,
+    }
+
+
+def format_report(rows: list, baseline: dict = None) -> str:
+    header = f"{'策略':<22}{'成功/总数':>12}{'mock收到':>10}{'links/s':>10}{'p50(s)':>9}{'p99(s)':>9}{'峰值内存MB':>12}"
+    if baseline:
+        header += f"{'吞吐对比基线':>14}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        if "skipped" in row:
+            lines.append(f"{row['strategy']:<22}跳过: {row['skipped']}")
+            continue
+        line = (f"{row['strategy']:<22}{row['ok']:>6}/{row['links']:<5}{row['created_on_mock']:>10}"
+                f"{row['links_per_s']:>10.2f}{row['p50_s']:>9.3f}{row['p99_s']:>9.3f}{row['peak_rss_mb']:>12.0f}")
+        base = (baseline or {}).get(row["strategy"])
+        if base and base.get("links_per_s"):
+            change = (row["links_per_s"] / base["links_per_s"] - 1) * 100
+            line += f"{change:>+13.1f}%"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="磁力提交方式性能测试（本地模拟迅雷页面）")
+    parser.add_argument("--app", choices=sorted(APP_PATHS), default="windows", help="测试哪个版本的 app.py")
+    parser.add_argument("--links", type=int, default=100, help="每种策略提交的链接数")
+    parser.add_argument("--strategies", nargs="+", default=DEFAULT_STRATEGIES)
+    parser.add_argument("--parse-delay", type=float, default=0.2, help="模拟页面每次解析的固定耗时(秒)")
+    parser.add_argument("--parse-delay-per-link", type=float, default=0.0, help="每条链接额外的解析耗时(秒)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="每条链接解析失败的概率")
+    parser.add_argument("--rate", type=float, default=0.0, help="全局限速(条/秒)，0 表示不限速")
+    parser.add_argument("--baseline", help="与该基线文件（--save-baseline 生成）对比")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线文件")
+    args = parser.parse_args()
+
+    app = load_app(args.app)
+    links = make_links(args.links)
+    server = MockXunleiServer(parse_delay=args.parse_delay, parse_delay_per_link=args.parse_delay_per_link,
+                              failure_rate=args.failure_rate).start()
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # 去重索引与断点文件都放到临时目录，测试不会污染真实记录
+            app.MAGNET_INDEX = app.MagnetIndex(os.path.join(workdir, "submitted_magnets.txt"))
+            app.SUBMIT_RATE_LIMITER = app.RateLimiter(args.rate)
+            for strategy in args.strategies:
+                print(f"[INFO] 运行 {strategy} ...", file=sys.stderr)
+                rows.append(run_strategy(app, server, strategy, links, os.path.join(workdir, "jobs")))
+    finally:
+        app.BROWSER_POOL.close_all()
+        server.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print(format_report(rows, baseline))
+
+    if args.save_baseline:
+        payload = {
+            "params": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline")},
+            "results": {row["strategy"]: row for row in rows if "skipped" not in row},
+        }
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"[INFO] 基线已保存到 {args.save_baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
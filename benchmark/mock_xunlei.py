@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的迅雷 Docker Web 界面，供性能测试使用（不需要真实的迅雷容器）。
+
+- GET  /               : 还原 start_download 依赖的页面元素
+                         (.create__task / .nas-task-dialog / .el-textarea__inner /
+                          .task-parse-btn / .result-nas-task-dialog_footer)
+- index.cgi 下的接口    : 与 HTTP 提交后端使用的接口一致（令牌、设备信息、解析、创建任务）
+
+解析耗时与失败率可配置；单独运行即可手动在浏览器里打开：
+    python benchmark/mock_xunlei.py --port 2345 --parse-delay 0.5 --failure-rate 0.1
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_PREFIX = "/webman/3rdparty/pan-xunlei-com/index.cgi"
+MOCK_TOKEN = "mock-pan-auth-token"
+MOCK_DEVICE_ID = "device_id#mock"
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Mock Xunlei</title>
+<style>
+  .hidden { display: none; }
+  .el-textarea__inner { width: 600px; height: 160px; }
+</style>
+</head>
+<body>
+<button class="create__task">新建任务</button>
+
+<div class="el-dialog__wrapper nas-task-dialog hidden">
+  <div class="el-dialog">
+    <div class="el-dialog__body">
+      <textarea class="el-textarea__inner"></textarea>
+      <div class="el-loading-mask hidden">解析中...</div>
+    </div>
+    <div class="el-dialog__footer">
+      <button class="el-button el-button--primary task-parse-btn">确定</button>
+    </div>
+  </div>
+</div>
+
+<div class="result-nas-task-dialog hidden">
+  <ul class="task-list"></ul>
+  <div class="result-nas-task-dialog_footer">
+    <button class="el-button el-button--primary task-parse-btn">立即下载</button>
+  </div>
+</div>
+
+<script>
+const PARSE_DELAY_MS = __PARSE_DELAY_MS__;
+const PARSE_DELAY_PER_LINK_MS = __PARSE_DELAY_PER_LINK_MS__;
+const FAILURE_RATE = __FAILURE_RATE__;
+
+const $ = (sel) => document.querySelector(sel);
+const show = (el) => el.classList.remove("hidden");
+const hide = (el) => el.classList.add("hidden");
+
+const dialog = $(".nas-task-dialog");
+const textarea = $(".el-textarea__inner");
+const mask = $(".nas-task-dialog .el-loading-mask");
+const parseBtn = $(".el-dialog__footer .task-parse-btn");
+const resultDialog = $(".result-nas-task-dialog");
+const resultList = $(".result-nas-task-dialog .task-list");
+const downloadBtn = $(".result-nas-task-dialog_footer .task-parse-btn");
+let parsedLinks = [];
+
+$(".create__task").addEventListener("click", () => {
+  textarea.value = "";
+  show(dialog);
+});
+
+parseBtn.addEventListener("click", () => {
+  const links = textarea.value.split("\\n").map((s) => s.trim()).filter(Boolean);
+  if (!links.length || parseBtn.classList.contains("is-loading")) return;
+  parseBtn.classList.add("is-loading");
+  show(mask);
+  setTimeout(() => {
+    hide(mask);
+    parseBtn.classList.remove("is-loading");
+    resultList.innerHTML = "";
+    parsedLinks = [];
+    for (const link of links) {
+      const item = document.createElement("li");
+      item.className = "task-item";
+      item.textContent = link;
+      if (Math.random() < FAILURE_RATE) {
+        item.classList.add("is-error");
+      } else {
+        parsedLinks.push(link);
+      }
+      resultList.appendChild(item);
+    }
+    downloadBtn.disabled = parsedLinks.length === 0;
+    downloadBtn.classList.toggle("is-disabled", parsedLinks.length === 0);
+    hide(dialog);
+    show(resultDialog);
+  }, PARSE_DELAY_MS + PARSE_DELAY_PER_LINK_MS * links.length);
+});
+
+downloadBtn.addEventListener("click", () => {
+  fetch("/mock/created", {method: "POST", body: JSON.stringify(parsedLinks)})
+    .then(() => hide(resultDialog));
+});
+</script>
+</body>
+</html>
+"""
+
+
+class MockXunleiServer:
+    """
+    在后台线程中运行的模拟服务器。
+    parse_delay: 每次解析的固定耗时(秒)；parse_delay_per_link: 每多一条链接额外增加的耗时(秒)
+    failure_rate: 每条链接解析失败的概率；seed: 失败判定用的随机种子，每次 reset() 都重新播种，
+    这样每种策略面对的是同一串失败判定（并发时各请求到达的先后不同，失败总数相同）
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, parse_delay: float = 0.2,
+                 parse_delay_per_link: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.parse_delay = parse_delay
+        self.parse_delay_per_link = parse_delay_per_link
+        self.failure_rate = failure_rate
+        self.created_links = []
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-xunlei", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.created_links = []
+            self._random.seed(self.seed)
+
+    def render_page(self) -> str:
+        return (PAGE_TEMPLATE
+                .replace("__PARSE_DELAY_MS__", str(int(self.parse_delay * 1000)))
+                .replace("__PARSE_DELAY_PER_LINK_MS__", str(int(self.parse_delay_per_link * 1000)))
+                .replace("__FAILURE_RATE__", repr(float(self.failure_rate))))
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def _record_created(self, links: list):
+        with self._lock:
+            self.created_links.extend(links)
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, content_type="application/json", status=200):
+                if not isinstance(body, str):
+                    body = json.dumps(body, ensure_ascii=False)
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_json(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    return json.loads(raw or b"{}")
+                except ValueError:
+                    return {}
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path in ("/", "/index.html"):
+                    return self._send(mock.render_page(), "text/html")
+                if path.rstrip("/") == API_PREFIX:
+                    page = f'<script>function uiauth(value){{ return "{MOCK_TOKEN}" }}</script>'
+                    return self._send(page, "text/html")
+                return self._send({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                path = self.path.split("?", 1)[0]
+                body = self._read_json()
+                if path == "/mock/created":
+                    mock._record_created(body if isinstance(body, list) else [])
+                    return self._send({"ok": True})
+                if not path.startswith(API_PREFIX):
+                    return self._send({"error": "not found"}, status=404)
+                if self.headers.get("pan-auth") != MOCK_TOKEN:
+                    return self._send({"error": "unauthorized", "error_code": 16}, status=401)
+
+                api = path[len(API_PREFIX):]
+                if api == "/device/info/watch":
+                    return self._send({"target": MOCK_DEVICE_ID})
+                if api == "/drive/v1/resource/list":
+                    links = [s for s in str(body.get("urls", "")).splitlines() if s.strip()]
+                    time.sleep(mock.parse_delay + mock.parse_delay_per_link * len(links))
+                    if not links or mock._should_fail():
+                        return self._send({"error": "mock parse failure", "error_code": 400})
+                    resources = [{
+                        "name": f"mock-{i}",
+                        "file_size": 1024,
+                        "file_count": 1,
+                        "is_dir": False,
+                        "file_index": 0,
+                        "meta": {"url": link},
+                    } for i, link in enumerate(links)]
+                    return self._send({"list": {"resources": resources}})
+                if api == "/drive/v1/task":
+                    url = (body.get("params") or {}).get("url")
+                    mock._record_created([url] if url else [])
+                    return self._send({"task": {"id": f"task-{len(mock.created_links)}"}})
+                return self._send({"error": "not found"}, status=404)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的迅雷 Docker Web 界面")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2345)
+    parser.add_argument("--parse-delay", type=float, default=0.2, help="每次解析的固定耗时(秒)")
+    parser.add_argument("--parse-delay-per-link", type=float, default=0.0, help="每条链接额外的解析耗时(秒)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="每条链接解析失败的概率")
+    args = parser.parse_args()
+
+    server = MockXunleiServer(args.host, args.port, args.parse_delay, args.parse_delay_per_link, args.failure_rate)
+    server.start()
+    print(f"模拟迅雷页面已启动: {server.url}  (Ctrl+C 退出)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
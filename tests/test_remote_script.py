@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+远程模式（SSH）生成的 shell 脚本：经 LocalScriptRunner 在本机的 sh 中实际执行，检查每种操作的结果。
+
+    python -m unittest discover tests
+"""
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    """按文件路径加载 app.py（没有打包成模块）。"""
+    spec = importlib.util.spec_from_file_location("xunlei_app_windows", os.path.join(REPO_ROOT, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+
+@unittest.skipIf(os.name == "nt" or shutil.which("sh") is None, "需要 POSIX sh")
+class RemoteScriptTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        # 本机路径与“服务器”路径相同，脚本直接在本机执行
+        self.ops = app.RemoteFileOps(app.LocalScriptRunner(), app.RemotePathMapper([(self.root, self.root)]))
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def write(self, name, content):
+        with open(self.path(name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(self.path(name), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def test_mkdir_creates_parents(self):
+        outcomes = self.ops.run([("mkdir", self.path("a", "b", "c")), ("mkdir", self.path("a", "b", "c"))])
+        self.assertEqual([ok for ok, _ in outcomes], [True, True])
+        self.assertTrue(os.path.isdir(self.path("a", "b", "c")))
+
+    def test_rename_does_not_overwrite(self):
+        self.write("src.mkv", "new")
+        self.write("taken.mkv", "PRECIOUS")
+        outcomes = self.ops.run([
+            ("rename", self.path("src.mkv"), self.path("taken.mkv")),
+            ("rename", self.path("src.mkv"), self.path("free.mkv")),
+        ])
+        self.assertFalse(outcomes[0][0])
+        self.assertEqual(outcomes[0][1], "目标已存在")
+        self.assertEqual(self.read("taken.mkv"), "PRECIOUS")
+        self.assertEqual(outcomes[1], (True, ""))
+        self.assertEqual(self.read("free.mkv"), "new")
+        self.assertFalse(os.path.exists(self.path("src.mkv")))
+
+    def test_ln_keeps_source_and_reports_method(self):
+        self.write("src.mkv", "data")
+        self.write("taken.mkv", "PRECIOUS")
+        outcomes = self.ops.run([
+            ("ln", self.path("src.mkv"), self.path("archive.mkv")),
+            ("ln", self.path("src.mkv"), self.path("taken.mkv")),
+        ])
+        ok, method = outcomes[0]
+        self.assertTrue(ok)
+        self.assertIn(method, ("硬链接", "reflink", "复制"))
+        self.assertEqual(self.read("archive.mkv"), "data")
+        self.assertEqual(self.read("src.mkv"), "data")
+        self.assertEqual(outcomes[1], (False, "目标已存在"))
+        self.assertEqual(self.read("taken.mkv"), "PRECIOUS")
+
+    def test_failure_does_not_stop_later_ops(self):
+        os.makedirs(self.path("full"))
+        self.write(os.path.join("full", "f"), "")
+        os.makedirs(self.path("empty"))
+        outcomes = self.ops.run([
+            ("rmdir", self.path("full")),
+            ("rmdir", self.path("empty")),
+        ])
+        self.assertFalse(outcomes[0][0])
+        self.assertTrue(outcomes[1][0])
+        self.assertTrue(os.path.isdir(self.path("full")))
+        self.assertFalse(os.path.exists(self.path("empty")))
+
+    def test_paths_are_quoted(self):
+        name = "it's $(touch pwned) `x` 第1集.mkv"
+        self.write(name, "q")
+        outcomes = self.ops.run([("rename", self.path(name), self.path("ok.mkv"))])
+        self.assertEqual(outcomes, [(True, "")])
+        self.assertFalse(os.path.exists("pwned"))
+        self.assertFalse(os.path.exists(self.path("pwned")))
+
+    def test_paths_are_mapped_and_unmapped_paths_fail(self):
+        # 本机看到的 local 对应服务器上的 server；不在共享下的路径不执行，直接判为失败
+        os.makedirs(self.path("local"))
+        ops = app.RemoteFileOps(app.LocalScriptRunner(),
+                                app.RemotePathMapper([(self.path("local"), self.path("server"))]))
+        outcomes = ops.run([
+            ("mkdir", self.path("local", "show")),
+            ("mkdir", self.path("outside", "x")),
+        ])
+        self.assertTrue(outcomes[0][0])
+        self.assertTrue(os.path.isdir(self.path("server", "show")))
+        self.assertFalse(outcomes[1][0])
+        self.assertFalse(os.path.exists(self.path("outside")))
+
+    def test_make_dirs_on_server_journals_each_new_level(self):
+        # 远程模式下移动 / 路由归档用这个在服务器上创建目标文件夹
+        journal = app.OperationJournal.begin("move", "test", self.path("journal"))
+        with journal:
+            app.make_dirs(self.path("lib", "show"), journal, self.ops)
+        self.assertTrue(os.path.isdir(self.path("lib", "show")))
+        _, actions = app.load_operation_journal(journal.path)
+        self.assertEqual(actions, [["mkdir", self.path("lib")], ["mkdir", self.path("lib", "show")]])
+
+
+if __name__ == "__main__":
+    unittest.main()